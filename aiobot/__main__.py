@@ -3,6 +3,8 @@ import jinja2
 
 from db import db_engine
 from utils.jinja2 import jinja_render, get_filters
+from utils.client_async import http_session
+from apps.parser import parse_executor
 from settings.settings import schedule, APP_DIR, config
 from settings.log import configure_logging
 from utils.scheduler import Scheduler
@@ -26,6 +28,8 @@ def start_bot():
 
 async def on_startup(dispatcher):
     await db_engine.create(config['postgres_db'])
+    await http_session.create(config.get('http_client'))
+    parse_executor.setup(config.get('parser', {}).get('processes'))
 
     path = os.path.join(APP_DIR, 'apps/shopwatcher/templates')
     jinja_render.setup(
@@ -37,6 +41,8 @@ async def on_startup(dispatcher):
 
 
 async def on_shutdown(dispatcher):
+    parse_executor.shutdown()
+    await http_session.close()
     await db_engine.close()
 
 
@@ -1,6 +1,8 @@
 from .parsers import get_parser
 from .exceptions import ParseError
+from .executor import parse_executor
+from .batcher import RequestBatcher
 
 __all__ = (
-    'get_parser', 'ParseError',
+    'get_parser', 'ParseError', 'parse_executor', 'RequestBatcher',
 )
@@ -1,19 +1,54 @@
+import asyncio
+
 from apps.shopwatcher.management import send_msg_admins
 
 from decimal import InvalidOperation
 
-from utils.client_async import AdapterAioHttp
+from utils.client_async import (
+    AdapterAioHttp, SingleFlight, MappedResponseBody, normalize_url, get_charset
+    )
 
 from .exceptions import ParseError
+from .executor import parse_executor
 
+# сколько секунд отдавать результат парсинга той же ссылки без нового запроса
+PARSE_RESULT_TTL = 10
+
+parse_flight = SingleFlight(ttl=PARSE_RESULT_TTL)
 
-class BaseParser:
 
+class BaseParser:
+    """
+    multi_stage - парсер с дополнительными запросами после разбора первой страницы:
+        _parse возвращает (requests, state), где requests - список параметров
+        для connector.perform_request (url, method, headers, cookies, json),
+        запросы выполняются одновременно, затем
+        _combine(state, contents) собирает результат из state и тел ответов
+        (в том же порядке, что и requests)
+    content_as_bytes - парсер разбирает тело ответа как bytes (lxml, json.loads)
+        без декодирования всей страницы в str, кодировка из заголовков ответа
+        передается в _parse в параметре encoding
+    content_mapped - для content_as_bytes: первая страница может быть MappedResponseBody
+        (большой ответ во временном файле), парсер разбирает ее через get_html_tree
+        и find_json_*, иначе такое тело копируется в bytes
+    decode_errors - обработка ошибок декодирования ответов (как в bytes.decode)
+    """
     shop_name = None
+    multi_stage = False
+    content_as_bytes = False
+    content_mapped = False
+    decode_errors = 'strict'
 
     def __init__(self):
         self.warning_msgs = []
 
+    async def parse_url(self, url: str, **kwargs):
+        """Вызывается в url_handler.py
+        одновременно отправленные одинаковые ссылки парсятся один раз
+        """
+        key = (self.shop_name, normalize_url(url))
+        return await parse_flight.do(key, self.get_response_and_parse, url, **kwargs)
+
     async def get_response_and_parse(self, url: str, **kwargs):
         """Вызывается в views.py
         """
@@ -28,17 +63,75 @@ class BaseParser:
         return await self.parse_response(response_data_raw, **params)
 
     async def parse_response(self, data_raw: bytes, **params):
-        """Вызывается в tasks.py и из get_response_and_parse()"""
+        """Вызывается в tasks.py и из get_response_and_parse()
+        для multi_stage в params должен быть connector для дополнительных запросов
+        и может быть batcher (RequestBatcher) для объединения запросов разных товаров
+        """
         try:
-            response_data = data_raw.decode(encoding='utf-8')
-            parse_result = self._parse(response_data, **params)
+            response_data = self.get_content(data_raw, allow_mapped=self.content_mapped)
+            # connector и batcher нужны только многоэтапным парсерам и не передаются в другой процесс
+            params_parse = {key: val for key, val in params.items() if key not in ('connector', 'batcher')}
+            params_parse['encoding'] = get_charset(data_raw)
+            parse_result = await self.run_parse_step('_parse', response_data, **params_parse)
+            if self.multi_stage:
+                requests, state = parse_result
+                contents = await self.perform_requests(params['connector'], requests,
+                                                       batcher=params.get('batcher'))
+                parse_result = await self.run_parse_step('_combine', state, contents)
         except (LookupError, TypeError, ValueError, InvalidOperation, ParseError) as e:
             # LookupError parent of IndexError, KeyError
-            raise ParseError(f"Парсер {self.shop_name} - ошибка {type(e)}: {str(e)}")
+            raise ParseError(f"Парсер {self.shop_name} - ошибка {type(e)}: {str(e)}",
+                             message_user=getattr(e, 'message_user', None))
 
         await self.check_and_send_warnings(params.get('url_parse'))
         return parse_result
 
+    async def perform_requests(self, connector, requests, batcher=None):
+        """
+        Одновременное выполнение дополнительных запросов многоэтапного парсера,
+        при ошибке одного из запросов остальные отменяются
+        """
+        tasks = [asyncio.ensure_future(self._perform_request(connector, request, batcher))
+                 for request in requests]
+        try:
+            return await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+    async def _perform_request(self, connector, request, batcher):
+        """
+        запрос с ключом batch (см. RequestBatcher) при наличии batcher выполняется
+        вместе с такими же запросами других товаров, иначе - отдельно
+        """
+        if 'batch' in request:
+            if batcher is not None:
+                return await batcher.perform(self, request)
+            request = {key: val for key, val in request.items() if key != 'batch'}
+        response = await connector.perform_request(**request)
+        return self.get_content(response)
+
+    def get_content(self, data_raw, allow_mapped=False):
+        """Тело ответа в том виде, в котором его разбирает парсер"""
+        if self.content_as_bytes:
+            if isinstance(data_raw, MappedResponseBody) and not allow_mapped:
+                return data_raw.tobytes()
+            return data_raw
+        return data_raw.decode(encoding=get_charset(data_raw), errors=self.decode_errors)
+
+    async def run_parse_step(self, method_name, *args, **kwargs):
+        """
+        Выполнение чистого (без запросов) шага парсинга,
+        если включен пул процессов - в отдельном процессе,
+        аргументы и результат должны сериализоваться pickle
+        """
+        if not parse_executor.is_enabled:
+            return getattr(self, method_name)(*args, **kwargs)
+        result, warning_msgs = await parse_executor.run(self.shop_name, method_name, *args, **kwargs)
+        self.warning_msgs.extend(warning_msgs)
+        return result
+
     async def check_and_send_warnings(self, url):
         if self.warning_msgs:
             msg = f"Парсер {self.shop_name}: url - {url}\n"
@@ -47,3 +140,14 @@ class BaseParser:
 
     def _parse(self, content, **params):
         raise NotImplementedError()
+
+    def _combine(self, state, contents):
+        raise NotImplementedError()
+
+    def _batch_merge(self, requests):
+        """Один запрос вместо нескольких запросов с одинаковым batch['key']"""
+        raise NotImplementedError()
+
+    def _batch_split(self, content, ids):
+        """Деление ответа на объединенный запрос: {batch['id']: content}"""
+        raise NotImplementedError()
@@ -0,0 +1,105 @@
+import asyncio
+
+from .exceptions import ParseError
+
+
+class RequestBatcher:
+    """
+    Объединение дополнительных запросов разных товаров одного магазина (для парсинга по расписанию):
+        запросы с ключом batch ({'key': ..., 'id': ...}) и одинаковым key собираются
+        в течение window секунд (или до max_size разных id), затем парсер
+        объединяет их в один запрос (_batch_merge) и делит ответ по id (_batch_split)
+
+    если в группе оказался один id, то выполняется исходный запрос
+    close() отменяет несобранные группы и выполняющиеся запросы групп
+    """
+    def __init__(self, connector, window=0.5, max_size=20):
+        self.connector = connector
+        self.window = window
+        self.max_size = max_size
+        self._groups = {}
+        # выполняющиеся запросы групп (ссылки, чтобы задачи не удалил сборщик мусора)
+        self._tasks = set()
+        self.count_requests = 0
+        self.count_batched = 0
+
+    async def perform(self, parser, request):
+        """Возвращает тело ответа (как parser.get_content) для запроса одного товара"""
+        batch = request['batch']
+        group_key = (parser.shop_name, batch['key'])
+        group = self._groups.get(group_key)
+        if group is None:
+            group = self._groups[group_key] = {'parser': parser, 'items': {}}
+            loop = asyncio.get_running_loop()
+            group['timer'] = loop.call_later(self.window, self._flush, group_key)
+
+        item = group['items'].get(batch['id'])
+        if item is None:
+            future = asyncio.get_running_loop().create_future()
+            item = group['items'][batch['id']] = {'request': request, 'future': future}
+            if len(group['items']) >= self.max_size:
+                self._flush(group_key)
+        # shield - отмена парсинга одного товара не должна отменять запрос группы
+        return await asyncio.shield(item['future'])
+
+    def get_stats(self):
+        return {'requests': self.count_requests, 'batched': self.count_batched}
+
+    async def close(self):
+        for group in self._groups.values():
+            group['timer'].cancel()
+            _cancel_futures(group['items'])
+        self._groups = {}
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def _flush(self, group_key):
+        group = self._groups.pop(group_key, None)
+        if group is None:
+            return
+        group['timer'].cancel()
+        task = asyncio.ensure_future(self._perform_group(group['parser'], group['items']))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _perform_group(self, parser, items):
+        self.count_requests += 1
+        self.count_batched += len(items)
+        try:
+            if len(items) == 1:
+                item, = items.values()
+                contents = {item['request']['batch']['id']: await self._request(item['request'], parser)}
+            else:
+                request = parser._batch_merge([item['request'] for item in items.values()])
+                content = await self._request(request, parser)
+                contents = parser._batch_split(content, list(items))
+        except asyncio.CancelledError:
+            _cancel_futures(items)
+            raise
+        except Exception as e:
+            for item in items.values():
+                if not item['future'].done():
+                    item['future'].set_exception(e)
+            return
+
+        for item_id, item in items.items():
+            if item['future'].done():
+                continue
+            content = contents.get(item_id)
+            if content is None:
+                item['future'].set_exception(ParseError(f"В общем ответе нет данных для {item_id}"))
+            else:
+                item['future'].set_result(content)
+
+    async def _request(self, request, parser):
+        params = {key: val for key, val in request.items() if key != 'batch'}
+        response = await self.connector.perform_request(**params)
+        return parser.get_content(response)
+
+
+def _cancel_futures(items):
+    for item in items.values():
+        if not item['future'].done():
+            item['future'].cancel()
@@ -0,0 +1,5 @@
+from .runner import run_bench, compare_results
+
+__all__ = (
+    'run_bench', 'compare_results',
+)
@@ -0,0 +1,49 @@
+"""
+Бенчмарк парсеров на сохраненных страницах (запуск из каталога aiobot):
+
+    python -m apps.parser.bench [shop ...] [--number 100] [--output bench.json] [--compare old.json]
+
+--output - сохранить результаты в json, чтобы сравнить с другим коммитом через --compare
+"""
+import argparse
+import json
+
+from .cases import CASES
+from .runner import run_bench, compare_results
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(prog='python -m apps.parser.bench')
+    arg_parser.add_argument('shops', nargs='*', help=f"по умолчанию все: {', '.join(sorted(CASES))}")
+    arg_parser.add_argument('--number', type=int, default=100, help='прогонов на магазин')
+    arg_parser.add_argument('--warmup', type=int, default=5)
+    arg_parser.add_argument('--output', help='файл для результатов в json')
+    arg_parser.add_argument('--compare', help='json с результатами прошлого запуска')
+    args = arg_parser.parse_args()
+    unknown = set(args.shops) - set(CASES)
+    if unknown:
+        arg_parser.error(f"нет сценария для магазинов: {', '.join(sorted(unknown))}")
+
+    report = run_bench(shops=args.shops, number=args.number, warmup=args.warmup)
+
+    diff = {}
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            diff = compare_results(json.load(f), report)
+        report['compare'] = {'base': args.compare, 'diff_percent': diff}
+
+    # rss KB - прирост пикового RSS процесса (с памятью libxml2), heap KB - только куча python
+    print(f"{'shop':<12} {'pages/s':>9} {'p50 ms':>9} {'p99 ms':>9} {'rss KB':>9} {'heap KB':>9} {'vs base':>9}")
+    for shop_name, result in report['results'].items():
+        change = diff.get(shop_name, {}).get('pages_per_sec')
+        change_text = '' if change is None else f"{change:+.1f}%"
+        print(f"{shop_name:<12} {result['pages_per_sec']:>9} {result['p50_ms']:>9} "
+              f"{result['p99_ms']:>9} {result['peak_rss_kb']:>9} {result['py_heap_kb']:>9} {change_text:>9}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
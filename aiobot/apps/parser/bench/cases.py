@@ -0,0 +1,67 @@
+"""
+Сценарии бенчмарка парсеров: для каждого магазина файл с сохраненной
+(обезличенной) страницей или ответом api в fixtures/, метод парсера
+и параметры, которые в рабочем режиме передаются в parse_response
+"""
+CASES = {
+    'asos': {
+        'fixture': 'asos.html',
+        'params': {'url_parse': 'https://www.asos.com/ru/brand/futbolka/prd/1000001'},
+        },
+    'fitnessbar': {
+        'fixture': 'fitnessbar.html',
+        'params': {'url_parse': 'https://www.fitnessbar.ru/catalog/protein/whey-0/'},
+        },
+    'henderson': {
+        'fixture': 'henderson.html',
+        'params': {'url_parse': 'https://henderson.ru/product/ABC-1234/'},
+        },
+    'hm': {
+        'fixture': 'hm.html',
+        'params': {'url_parse': 'https://www2.hm.com/ru_ru/productpage.0123456000.html'},
+        },
+    'letu': {
+        'fixture': 'letu.json',
+        'params': {
+            'url_product': 'https://www.letu.ru/product/brand-parfum/100200',
+            'url_parse': 'https://www.letu.ru/product/brand-parfum/100200?format=json',
+            'sku_selected': '400001',
+            },
+        },
+    'mango': {
+        'fixture': 'mango.json',
+        'params': {
+            'url_parse': 'https://shop.mango.com/services/garments/67070518',
+            'url_product': 'https://shop.mango.com/ru/women/coat_67070518.html',
+            'color_selected': '11',
+            },
+        },
+    'nike': {
+        'fixture': 'nike.html',
+        'params': {'color_selected': 'CD6279-100'},
+        },
+    'ozon': {
+        'fixture': 'ozon.html',
+        'params': {},
+        },
+    'rivegauche': {
+        'fixture': 'rivegauche.html',
+        'params': {'url_parse': 'https://rivegauche.ru/product/brand-887766'},
+        },
+    'uniqlo': {
+        'fixture': 'uniqlo.json',
+        'params': {
+            'url_parse': 'https://www.uniqlo.com/ru/estore/data/products/spu/ru_RU/u0000000012345.json',
+            'url_product': ('https://www.uniqlo.com/ru/estore/ru_RU/product-detail.html'
+                            '?productCode=u0000000012345'),
+            },
+        },
+    'wildberries': {
+        'fixture': 'wildberries.html',
+        'params': {'url_parse': 'https://www.wildberries.ru/catalog/12345678/detail.aspx'},
+        },
+    'zara': {
+        'fixture': 'zara.html',
+        'params': {'url_parse': 'https://www.zara.com/ru/ru/coat-p01234567.html'},
+        },
+    }
@@ -0,0 +1,176 @@
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+from datetime import datetime
+
+from utils.client_async import ResponseBody, MappedResponseBody
+
+from ..parsers import get_parser
+from .cases import CASES
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def run_bench(shops=None, number=100, warmup=5):
+    """
+    Прогон _parse каждого магазина на сохраненной странице, без сети и БД
+
+    возвращает словарь для сохранения в json:
+        meta - версия python, коммит и параметры запуска
+        results - по магазинам: pages_per_sec, p50_ms, p99_ms, peak_rss_kb, py_heap_kb, warnings
+    """
+    if not shops:
+        shops = sorted(CASES)
+
+    results = {}
+    for shop_name in shops:
+        results[shop_name] = run_case(shop_name, CASES[shop_name], number, warmup)
+
+    return {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'commit': _get_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'number': number,
+            'warmup': warmup,
+            },
+        'results': results,
+        }
+
+
+def run_case(shop_name, case, number, warmup):
+    with open(os.path.join(FIXTURES_DIR, case['fixture']), 'rb') as f:
+        data_raw = f.read()
+    method_name = case.get('method', '_parse')
+    params = {**case['params'], 'encoding': 'utf-8'}
+    check_bodies(shop_name, method_name, data_raw, params)
+    # тело ответа в том виде, в котором его возвращает connector
+    body = ResponseBody(data_raw)
+
+    for _ in range(warmup):
+        _parse_page(get_parser(shop_name), method_name, body, params)
+
+    timings = []
+    for _ in range(number):
+        parser = get_parser(shop_name)
+        time_start = time.perf_counter()
+        _parse_page(parser, method_name, body, params)
+        timings.append(time.perf_counter() - time_start)
+
+    peak_rss = _measure_peak_rss(shop_name, method_name, body, params)
+    # память python меряем отдельным прогоном, т.к. tracemalloc замедляет выполнение
+    parser = get_parser(shop_name)
+    tracemalloc.start()
+    try:
+        _parse_page(parser, method_name, body, params)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    timings.sort()
+    return {
+        'size_kb': round(len(data_raw) / 1024, 1),
+        'pages_per_sec': round(len(timings) / sum(timings), 1),
+        'p50_ms': round(_percentile(timings, 50) * 1000, 3),
+        'p99_ms': round(_percentile(timings, 99) * 1000, 3),
+        'peak_rss_kb': peak_rss,
+        'py_heap_kb': round(peak / 1024, 1),
+        'warnings': len(parser.warning_msgs),
+        }
+
+
+def _parse_page(parser, method_name, data_raw, params):
+    """Как в parse_response: тело ответа в виде, который нужен парсеру, и первый шаг парсинга"""
+    content = parser.get_content(data_raw, allow_mapped=parser.content_mapped)
+    return getattr(parser, method_name)(content, **params)
+
+
+def _measure_peak_rss(shop_name, method_name, data_raw, params):
+    """
+    Прирост пикового RSS (КБ) за один парсинг в отдельном процессе (fork): в отличие
+    от tracemalloc учитывает и память libxml2 (деревья lxml), а не только кучу python
+    """
+    context = multiprocessing.get_context('fork')
+    conn_parent, conn_child = context.Pipe(duplex=False)
+    process = context.Process(
+        target=_peak_rss_child, args=(conn_child, shop_name, method_name, data_raw, params))
+    process.start()
+    conn_child.close()
+    try:
+        return conn_parent.recv()
+    finally:
+        conn_parent.close()
+        process.join()
+
+
+def _peak_rss_child(conn, shop_name, method_name, data_raw, params):
+    try:
+        parser = get_parser(shop_name)
+        # ru_maxrss в КБ (Linux), у процесса после fork - от его текущего RSS
+        rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        _parse_page(parser, method_name, data_raw, params)
+        conn.send(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_start)
+    finally:
+        conn.close()
+
+
+def check_bodies(shop_name, method_name, data_raw, params):
+    """
+    Результат парсинга тела ответа (ResponseBody) и большого тела во временном файле
+    (MappedResponseBody) должен совпадать с результатом для bytes, иначе ValueError
+    """
+    result = _parse_page(get_parser(shop_name), method_name, data_raw, params)
+    with tempfile.TemporaryFile() as spool:
+        spool.write(data_raw)
+        spool.flush()
+        bodies = {'ResponseBody': ResponseBody(data_raw), 'MappedResponseBody': MappedResponseBody(spool)}
+        try:
+            for body_name, body in bodies.items():
+                if _parse_page(get_parser(shop_name), method_name, body, params) != result:
+                    raise ValueError(f"{shop_name}: результат для {body_name} отличается от bytes")
+        finally:
+            bodies['MappedResponseBody'].close()
+
+
+def compare_results(base, current):
+    """Изменение показателей относительно base (результат прошлого запуска) в процентах"""
+    diff = {}
+    for shop_name, result in current['results'].items():
+        result_base = base['results'].get(shop_name)
+        if result_base is None:
+            continue
+        # в старых результатах нет peak_rss_kb (была только память python в peak_kb)
+        diff[shop_name] = {
+            key: _change_percent(result_base.get(key), result[key])
+            for key in ('pages_per_sec', 'p50_ms', 'p99_ms', 'peak_rss_kb', 'py_heap_kb')
+            }
+    return diff
+
+
+def _percentile(values_sorted, percent):
+    """Ближайший ранг по отсортированному списку"""
+    idx = max(0, -(-len(values_sorted) * percent // 100) - 1)
+    return values_sorted[idx]
+
+
+def _change_percent(old, new):
+    if not old:
+        return None
+    return round((new - old) / old * 100, 1)
+
+
+def _get_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(__file__),
+            capture_output=True, text=True, check=True
+            ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
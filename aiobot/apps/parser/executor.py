@@ -0,0 +1,47 @@
+import asyncio
+
+from concurrent.futures import ProcessPoolExecutor
+
+from .parsers import get_parser
+
+
+class ParseExecutor:
+    """
+    Выполнение чистых шагов парсинга (_parse и т.п.) в пуле процессов,
+    чтобы построение DOM больших страниц не блокировало цикл событий бота
+
+    создается в on_startup (config['parser']['processes']), если пул не создан,
+    то шаги парсинга выполняются в текущем процессе
+    """
+    def __init__(self):
+        self._executor = None
+
+    @property
+    def is_enabled(self):
+        return self._executor is not None
+
+    def setup(self, processes=None):
+        if processes:
+            self._executor = ProcessPoolExecutor(max_workers=processes)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def run(self, shop_name, method_name, *args, **kwargs):
+        """Возвращает результат шага и предупреждения парсера из процесса"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, _run_parse_step, shop_name, method_name, args, kwargs
+            )
+
+
+def _run_parse_step(shop_name, method_name, args, kwargs):
+    """Выполняется в процессе пула - парсер находим по имени магазина"""
+    parser = get_parser(shop_name)
+    result = getattr(parser, method_name)(*args, **kwargs)
+    return result, parser.warning_msgs
+
+
+parse_executor = ParseExecutor()
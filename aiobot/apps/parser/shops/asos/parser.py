@@ -2,12 +2,12 @@ import json
 
 from decimal import Decimal
 
-from urllib.parse import urlparse
+from urllib.parse import urlparse, urlsplit, urlunsplit, parse_qsl, urlencode
 
-from utils.client_async import AdapterAioHttp, ConnectionAioHttp
+from utils.client_async import AdapterAioHttp
 
 from ...exceptions import ParseError
-from ...utils import get_jsondata_from_html, get_text_from_area
+from ...utils import get_jsondata, get_text_from_area
 from ...base_parser import BaseParser
 
 # добавилось keyStoreDataversion, поэтому ищем ссылку на странице товара
@@ -15,10 +15,17 @@ from ...base_parser import BaseParser
 
 
 class Parser(BaseParser):
+    """
+    многоэтапный: цены и наличие размеров во втором запросе к api (stockPriceApiUrl),
+    api принимает несколько productIds через запятую, поэтому при парсинге по расписанию
+    запросы разных товаров объединяются (RequestBatcher)
+    """
     shop_name = 'asos'
+    multi_stage = True
     key_json = 'window.asos.pdp.config.product'
     # key_api = 'window.asos.pdp.stockApiRequest'
     key_api = 'window.asos.pdp.config.stockPriceApiUrl'
+    key_api_ids = 'productIds'
 
     async def get_response_and_parse(self, url: str, **kwargs):
         """Вызывается в views.py
@@ -42,28 +49,6 @@ class Parser(BaseParser):
                                              headers=headers,
                                              cookies=cookies)
 
-    async def parse_response(self,
-                             data_raw: bytes,
-                             connector: ConnectionAioHttp,
-                             **kwargs):
-        """Вызывается в tasks.py и из self.get_response_and_parse()
-        уникально тем, что есть второй запрос после обработки результатов первого
-        """
-        response_data = data_raw.decode(encoding='utf-8')
-        headers = kwargs.get('headers')
-        cookies = kwargs.get('cookies')
-        try:
-            url_api, product_data, sizes_const = self._parse(response_data, **kwargs)
-            # async with connector as _connector:
-            response_raw = await connector.perform_request(url=url_api, headers=headers, cookies=cookies)
-            parse_result = self._parse_second(response_raw.decode(encoding='utf-8'),
-                                              product_data, sizes_const)
-        except (LookupError, TypeError, ValueError, ParseError) as e:  # LookupError parent of IndexError, KeyError
-            raise ParseError(f"Парсер {self.shop_name} - ошибка {type(e)}: {str(e)}")
-
-        await self.check_and_send_warnings(parse_result['data']['reference'])
-        return parse_result
-
     def _parse(self, content, **kwargs):
         url_parse = kwargs.get('url_parse')
 
@@ -84,7 +69,7 @@ class Parser(BaseParser):
             #     with_sym=False
             #     )
 
-        data = get_jsondata_from_html(content, self.key_json, set_type_script=True)
+        data = get_jsondata(content, self.key_json, set_type_script=True)
 
         sizes_const = {}
         # раньше для формирования ссылки api использовался
@@ -111,7 +96,44 @@ class Parser(BaseParser):
                 'option_name': variant['size'], 'option_code': str(variant['sizeId'])
                 }
 
-        return url_api, product_data, sizes_const
+        if url_api is None:
+            raise ParseError('на странице не найдена ссылка на api')
+
+        request_api = {'url': url_api, 'headers': kwargs.get('headers'), 'cookies': kwargs.get('cookies')}
+        batch = self._get_batch_params(url_api)
+        if batch is not None:
+            request_api['batch'] = batch
+        return [request_api], (product_data, sizes_const)
+
+    def _combine(self, state, contents):
+        product_data, sizes_const = state
+        return self._parse_second(contents[0], product_data, sizes_const)
+
+    def _get_batch_params(self, url_api):
+        """ключ - ссылка на api без productIds (остальные параметры должны совпадать)"""
+        url_struct = urlsplit(url_api)
+        query = parse_qsl(url_struct.query, keep_blank_values=True)
+        product_ids = [val for key, val in query if key == self.key_api_ids]
+        if len(product_ids) != 1:
+            return None
+        query_other = sorted((key, val) for key, val in query if key != self.key_api_ids)
+        key = urlunsplit(url_struct._replace(query=urlencode(query_other)))
+        return {'key': key, 'id': product_ids[0]}
+
+    def _batch_merge(self, requests):
+        request = dict(requests[0])
+        url_struct = urlsplit(request['batch']['key'])
+        query = parse_qsl(url_struct.query, keep_blank_values=True)
+        query.append((self.key_api_ids, ','.join(item['batch']['id'] for item in requests)))
+        request['url'] = urlunsplit(url_struct._replace(query=urlencode(query, safe=',')))
+        return request
+
+    def _batch_split(self, content, ids):
+        data_api = json.loads(content)
+        products = {str(product['productId']): product for product in data_api}
+        # ответ для одного товара в том же виде, что и без объединения запросов
+        return {product_id: json.dumps([products[product_id]])
+                for product_id in ids if product_id in products}
 
     def _parse_second(self, content, product_data, sizes_const):
         data_api = json.loads(content)
@@ -1,18 +1,27 @@
 import json
 
-from lxml import html
 from decimal import Decimal
 from urllib.parse import urlparse
 
-from utils.client_async import AdapterAioHttp, ConnectionAioHttp
+from utils.client_async import AdapterAioHttp
 
 from ...exceptions import ParseError
+from ...utils import get_html_tree
 from ...base_parser import BaseParser
 
 
 
 class Parser(BaseParser):
+    """
+    многоэтапный: у товара с несколькими фасовками данные каждой фасовки
+    на отдельной странице, страницы загружаются одновременно
+    """
     shop_name = 'fitnessbar'
+    multi_stage = True
+    content_as_bytes = True
+    content_mapped = True
+    # возникала ошибка на byte 0xd0, отменил возбуждение UnicodeError
+    decode_errors = 'backslashreplace'
 
     async def get_response_and_parse(self, url: str, **kwargs):
         """Вызывается в views.py
@@ -26,58 +35,13 @@ class Parser(BaseParser):
                                              url_parse=url,
                                              )
 
-    async def parse_response(
-        self,
-        response_raw: bytes,
-        connector: ConnectionAioHttp,
-        **kwargs
-    ):
-        """
-        Вызывается в tasks.py и из self.get_response_and_parse()
-        уникально тем, что есть второй запрос после обработки результатов первого
-        """
-        # возникала ошибка на byte 0xd0, отменил возбуждение UnicodeError
-        url_parse = kwargs.get('url_parse')
-        response_data = response_raw.decode(encoding='utf-8', errors='backslashreplace')
-        try:
-            product_data, product_stocks, type_list, product_main_name = self._parse(response_data, **kwargs)
-            if len(type_list) > 1:
-                products = []
-                for type_data in type_list:
-                    if type_data['code'] == product_data['reference']:
-                        products.append(product_data)
-                    else:
-                        response_raw = await connector.perform_request(url=type_data['url'])
-                        product_data_i, product_stocks_i = self._parse_second(
-                            response_raw.decode(encoding='utf-8', errors='backslashreplace'),
-                            product_main_name, type_data
-                            )
-                        products.append(product_data_i)
-                        product_stocks.extend(product_stocks_i)
-
-                products[0]['parameters'] = {'types': type_list}
-                products[0]['stocks'] = product_stocks
-                parse_result = {'data': products}
-            else:
-                product_data['stocks'] = product_stocks
-                parse_result = {'data': product_data}
-
-        except (LookupError, TypeError, ValueError, ParseError) as e:  # LookupError parent of IndexError, KeyError
-            message_user = None
-            if isinstance(e, ParseError):
-                message_user = e.message_user
-            raise ParseError(f"Парсер {self.shop_name} - ошибка {type(e)}: {str(e)}", message_user=message_user)
-
-        await self.check_and_send_warnings(url_parse)
-        return parse_result
-
     def _parse(self, content, **kwargs):
         url_parse = kwargs.get('url_parse')
 
         url_struct = urlparse(url_parse)
         host = '%s://%s' % (url_struct.scheme, url_struct.netloc)
 
-        tree = html.fromstring(content)
+        tree = get_html_tree(content, kwargs.get('encoding', 'utf-8'))
 
         product_main_name = None
         product_type = None
@@ -105,7 +69,35 @@ class Parser(BaseParser):
 
         product_data = self._get_product_data(product_main_name, product_type)
         product_stocks = self._get_stocks_from_parse_params(product_type['code'], tree)
-        return product_data, product_stocks, type_list, product_main_name
+
+        requests = []
+        if len(type_list) > 1:
+            requests = [{'url': type_data['url']} for type_data in type_list
+                        if type_data['code'] != product_data['reference']]
+        return requests, (product_data, product_stocks, type_list, product_main_name)
+
+    def _combine(self, state, contents):
+        product_data, product_stocks, type_list, product_main_name = state
+        if len(type_list) <= 1:
+            product_data['stocks'] = product_stocks
+            return {'data': product_data}
+
+        # страницы фасовок в том же порядке, что и запросы в _parse
+        contents_iter = iter(contents)
+        products = []
+        for type_data in type_list:
+            if type_data['code'] == product_data['reference']:
+                products.append(product_data)
+            else:
+                product_data_i, product_stocks_i = self._parse_second(
+                    next(contents_iter), product_main_name, type_data
+                    )
+                products.append(product_data_i)
+                product_stocks.extend(product_stocks_i)
+
+        products[0]['parameters'] = {'types': type_list}
+        products[0]['stocks'] = product_stocks
+        return {'data': products}
 
     def _get_product_data(self, product_name, product_type):
         # if product_type['name']:
@@ -118,7 +110,7 @@ class Parser(BaseParser):
             }
 
     def _parse_second(self, content, product_name, product_type):
-        tree = html.fromstring(content)
+        tree = get_html_tree(content)
         product_data = self._get_product_data(product_name, product_type)
         product_stocks = self._get_stocks_from_parse_params(product_type['code'], tree)
         return product_data, product_stocks
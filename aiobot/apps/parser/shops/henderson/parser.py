@@ -1,15 +1,17 @@
-from lxml import html
 from decimal import Decimal
 
+from ...utils import get_html_tree
 from ...base_parser import BaseParser
 
 
 class Parser(BaseParser):
     shop_name = 'henderson'
+    content_as_bytes = True
+    content_mapped = True
 
     def _parse(self, content, **kwargs):
         url_parse = kwargs.get('url_parse')
-        tree = html.fromstring(content)
+        tree = get_html_tree(content, kwargs.get('encoding', 'utf-8'))
         product_data = self._get_product_data(tree, url_parse)
         return {'data': product_data}
 
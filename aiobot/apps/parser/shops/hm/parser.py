@@ -1,17 +1,20 @@
 import json
 
-from lxml import html
-
-
-from utils.client_async import AdapterAioHttp, ConnectionAioHttp
+from utils.client_async import AdapterAioHttp
 
 from ...exceptions import ParseError
-from ...utils import get_text_from_area, get_host_from_url
+from ...utils import get_text_from_area, get_host_from_url, get_html_tree
 from ...base_parser import BaseParser
 
 
 class Parser(BaseParser):
+    """
+    многоэтапный: наличие размеров во втором запросе к api (url_available_template)
+    """
     shop_name = 'hm'
+    multi_stage = True
+    content_as_bytes = True
+    content_mapped = True
     key_json = 'productArticleDetails'
     url_available_template = "%s/hmwebservices/service/product/ru/availability/%s.json"
 
@@ -30,32 +33,11 @@ class Parser(BaseParser):
                                              headers=headers,
                                              )
 
-    async def parse_response(self,
-                             data_raw: bytes,
-                             connector: ConnectionAioHttp,
-                             **kwargs):
-        """Вызывается в tasks.py и из self.get_response_and_parse()
-        уникально тем, что есть второй запрос после обработки результатов первого
-        """
-        response_data = data_raw.decode(encoding='utf-8')
-        headers = kwargs.get('headers')
-        try:
-            url_available, product_data, color_selected = self._parse(response_data, **kwargs)
-            # async with connector as _connector:
-            response_raw = await connector.perform_request(url=url_available, headers=headers)
-            parse_result = self._parse_second(response_raw.decode(encoding='utf-8'),
-                                              product_data, color_selected)
-        except (LookupError, TypeError, ValueError, ParseError) as e:  # LookupError parent of IndexError, KeyError
-            raise ParseError(f"Парсер {self.shop_name} - ошибка {type(e)}: {str(e)}")
-
-        await self.check_and_send_warnings(parse_result['data']['reference'])
-        return parse_result
-
     def _parse(self, content, **kwargs):
         url_parse = kwargs.get('url_parse')
         host = get_host_from_url(url_parse)
 
-        tree = html.fromstring(content)
+        tree = get_html_tree(content, kwargs.get('encoding', 'utf-8'))
 
         product_name = tree.xpath("//section[@class='name-price']/h1/text()")[0].strip()
 
@@ -116,7 +98,12 @@ class Parser(BaseParser):
             }
 
         url_available = self.url_available_template % (host, product_code)
-        return url_available, product_data, color_selected
+        request_available = {'url': url_available, 'headers': kwargs.get('headers')}
+        return [request_available], (product_data, color_selected)
+
+    def _combine(self, state, contents):
+        product_data, color_selected = state
+        return self._parse_second(contents[0], product_data, color_selected)
 
     def get_json_from_dom(self, script_text):
         data_text = get_text_from_area(script_text, self.key_json)
@@ -7,6 +7,7 @@ from ...base_parser import BaseParser
 
 class Parser(BaseParser):
     shop_name = 'letu'
+    content_as_bytes = True
 
     def _prepare_params(self, url: str, params):
         """ """
@@ -9,6 +9,7 @@ from ...base_parser import BaseParser
 
 class Parser(BaseParser):
     shop_name = 'mango'
+    content_as_bytes = True
     color_key = 'c'
     template_url = 'https://shop.mango.com/services/garments/%s'
 
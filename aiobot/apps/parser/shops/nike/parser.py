@@ -1,11 +1,13 @@
 
-from ...utils import get_jsondata_from_html
+from ...utils import get_jsondata
 from ...base_parser import BaseParser
 
 
 class Parser(BaseParser):
     shop_name = 'nike'
     key_json = 'INITIAL_REDUX_STATE'
+    content_as_bytes = True
+    content_mapped = True
 
     def _prepare_params(self, url: str, params):
         """ """
@@ -17,7 +19,7 @@ class Parser(BaseParser):
         """
         """
         color_selected = params.get('color_selected')
-        data = get_jsondata_from_html(content, self.key_json)
+        data = get_jsondata(content, self.key_json, encoding=params.get('encoding', 'utf-8'))
         product_url = data['App']['request']['URLS']['withoutStyleColor']
 
         sizes_stock_struct = {}
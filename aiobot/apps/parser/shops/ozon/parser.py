@@ -1,24 +1,22 @@
 import json
 
 from decimal import Decimal
-from lxml import html
 
 from ...exceptions import ParseError
+from ...utils import find_json_in_attribute, get_html_tree
 from ...base_parser import BaseParser
 
 
 class Parser(BaseParser):
     shop_name = 'ozon'
+    content_as_bytes = True
+    content_mapped = True
 
     def _parse(self, content, **params):
-        tree = html.fromstring(content)
-        el = tree.xpath("//div[starts-with(@id, 'state-webAddToCart')]")
-        if not el:
-            raise ParseError('На странице не найден основной элемент DOM, '
-                             f'размер контента {len(content)} символов')
-
-        data_json = el[0].attrib['data-state']
-        data = json.loads(data_json)
+        encoding = params.get('encoding', 'utf-8')
+        data = find_json_in_attribute(content, 'state-webAddToCart', 'data-state', encoding=encoding)
+        if data is None:
+            data = self._get_data_from_dom(content, encoding)
 
         product_info = data['cellTrackingInfo']['product']
 
@@ -45,3 +43,13 @@ class Parser(BaseParser):
         return {
             'data': product_data,
             }
+
+    def _get_data_from_dom(self, content, encoding):
+        tree = get_html_tree(content, encoding)
+        el = tree.xpath("//div[starts-with(@id, 'state-webAddToCart')]")
+        if not el:
+            raise ParseError('На странице не найден основной элемент DOM, '
+                             f'размер контента {len(content)} байт')
+
+        data_json = el[0].attrib['data-state']
+        return json.loads(data_json)
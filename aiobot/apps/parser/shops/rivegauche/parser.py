@@ -1,16 +1,18 @@
 from decimal import Decimal
-from lxml import html
 
+from ...utils import get_html_tree
 from ...base_parser import BaseParser
 from ...exceptions import ParseError
 
 
 class Parser(BaseParser):
     shop_name = 'rivegauche'
+    content_as_bytes = True
+    content_mapped = True
 
     def _parse(self, content, **params):
         url = params.get('url_parse')
-        tree = html.fromstring(content)
+        tree = get_html_tree(content, params.get('encoding', 'utf-8'))
         product_data = self._parse_content(tree, url)
         return {'data': product_data}
 
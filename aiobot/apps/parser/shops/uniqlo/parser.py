@@ -2,7 +2,7 @@ import json
 
 from urllib.parse import urlparse, parse_qsl
 
-from utils.client_async import AdapterAioHttp, ConnectionAioHttp
+from utils.client_async import AdapterAioHttp
 
 from ...exceptions import ParseError
 from ...base_parser import BaseParser
@@ -10,6 +10,8 @@ from ...base_parser import BaseParser
 
 class Parser(BaseParser):
     shop_name = 'uniqlo'
+    multi_stage = True
+    content_as_bytes = True
     url_product_tmplt = 'https://www.uniqlo.com/ru/estore/ru_RU/product-detail.html?productCode=%s'
     url_descr_tmplt = 'https://www.uniqlo.com/ru/estore/data/products/spu/ru_RU/%s.json'
     url_price_tmplt = 'https://d.uniqlo.com/ru/estore/product/i/product/spu/pc/query/%s/ru_RU'
@@ -56,41 +58,32 @@ class Parser(BaseParser):
             }
         return params
 
-    async def parse_response(self,
-                             response_raw: bytes,
-                             connector: ConnectionAioHttp,
-                             **kwargs):
+    def _parse(self, content, **kwargs):
         """
-        Вызывается в tasks.py и из self.get_response_and_parse()
-        уникально тем, что есть второй запрос после обработки результатов первого
+        цены и наличие в отдельных запросах к api, им нужен только product_code,
+        поэтому они выполняются одновременно
         """
-        selected = kwargs.get('selected')
-        response_data = response_raw.decode(encoding='utf-8')
-        try:
-            product_data, sku_data, product_code = self._parse_desc(response_data, **kwargs)
-            headers = kwargs.get('headers')
-            response_raw = await connector.perform_request(
-                url=self.url_price_tmplt % product_code, headers=headers
-                )
-            self._parse_price(response_raw.decode(encoding='utf-8'), sku_data)
-
-            json_payload = {
-                'distribution': "EXPRESS",
-                'productCode': product_code,
-                'type': "DETAIL",
-                }
-            response_raw = await connector.perform_request(url=self.url_stock, method="POST",
-                                                           headers=headers, json=json_payload)
-            self._parse_stock(response_raw.decode(encoding='utf-8'), sku_data)
-
-            product_data['stocks'] = list(sku_data.values())
-            parse_result = {'data': product_data, 'selected': selected}
-
-        except (LookupError, TypeError, ValueError, ParseError) as e:  # LookupError parent of IndexError, KeyError
-            raise ParseError(f"Парсер {self.shop_name} - ошибка {type(e)}: {str(e)}")
-
-        await self.check_and_send_warnings(parse_result['data']['reference'])
-        return parse_result
+        product_data, sku_data, product_code = self._parse_desc(content, **kwargs)
+        headers = kwargs.get('headers')
+        json_payload = {
+            'distribution': "EXPRESS",
+            'productCode': product_code,
+            'type': "DETAIL",
+            }
+        requests = [
+            {'url': self.url_price_tmplt % product_code, 'headers': headers},
+            {'url': self.url_stock, 'method': "POST", 'headers': headers, 'json': json_payload},
+            ]
+        return requests, (product_data, sku_data, kwargs.get('selected'))
+
+    def _combine(self, state, contents):
+        product_data, sku_data, selected = state
+        content_price, content_stock = contents
+        self._parse_price(content_price, sku_data)
+        self._parse_stock(content_stock, sku_data)
+
+        product_data['stocks'] = list(sku_data.values())
+        return {'data': product_data, 'selected': selected}
 
     def _parse_desc(self, content, **kwargs):
         url_parse = kwargs.get('url_parse')
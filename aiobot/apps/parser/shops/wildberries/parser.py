@@ -1,9 +1,8 @@
 import re
 import json
 
-from lxml import html
-
 from ...exceptions import ParseError
+from ...utils import find_json_after_key, get_html_tree
 from ...base_parser import BaseParser
 
 
@@ -11,6 +10,8 @@ class Parser(BaseParser):
     shop_name = 'wildberries'
     key_func = 'wb.spa.init'
     key_var = 'ssrModel'
+    content_as_bytes = True
+    content_mapped = True
 
     def _prepare_params(self, url: str, params):
         """
@@ -32,7 +33,7 @@ class Parser(BaseParser):
 
         url_tmplt = url_parse.replace(reference_with_bkt, "/%s/")
 
-        data = self._get_jsondata_from_html(content)
+        data = self._get_jsondata_from_html(content, params.get('encoding', 'utf-8'))
         if not data:
             raise ParseError('не найден контейнер с данными в javascript')
 
@@ -96,12 +97,22 @@ class Parser(BaseParser):
             'selected': reference_visit,
             }
 
-    def _get_jsondata_from_html(self, content):
+    def _get_jsondata_from_html(self, content, encoding='utf-8'):
         """
         поиск блока с данными неуниверсальный
         """
+        # сначала без DOM: объект ssrModel внутри вызова wb.spa.init
+        key_func = self.key_func
+        if not isinstance(content, str):
+            key_func = key_func.encode(encoding)
+        idx_func = content.find(key_func)
+        if idx_func != -1:
+            data = find_json_after_key(content, self.key_var, start=idx_func, encoding=encoding)
+            if data is not None:
+                return data
+
         offset = 29
-        tree = html.fromstring(content)
+        tree = get_html_tree(content, encoding)
 
         scripts_find = tree.xpath("//script[@type='text/javascript']/text()")
         for item in scripts_find:
@@ -1,8 +1,7 @@
 import json
 
-from lxml import html
-
 from ...exceptions import ParseError
+from ...utils import find_json_after_key, get_html_tree
 from ...base_parser import BaseParser
 
 
@@ -10,6 +9,8 @@ class Parser(BaseParser):
     shop_name = 'zara'
     color_key = 'v1'
     key_json = 'window.zara.viewPayload'
+    content_as_bytes = True
+    content_mapped = True
 
     def _prepare_params(self, url: str, params):
         """ """
@@ -21,8 +22,12 @@ class Parser(BaseParser):
         params['url_parse'] = url_parse
         return url_parse
 
-    def get_jsondata_from_html(self, content):
-        tree = html.fromstring(content)
+    def get_jsondata_from_html(self, content, encoding='utf-8'):
+        data = find_json_after_key(content, self.key_json, encoding=encoding)
+        if data is not None:
+            return data
+
+        tree = get_html_tree(content, encoding)
         scripts_find = tree.xpath("//script[@type='text/javascript']/text()")
 
         script_text = None
@@ -48,7 +53,7 @@ class Parser(BaseParser):
         """
         url_parse = params.get('url_parse')
 
-        data = self.get_jsondata_from_html(content)
+        data = self.get_jsondata_from_html(content, params.get('encoding', 'utf-8'))
 
         product = data['product']
         name = product['name']
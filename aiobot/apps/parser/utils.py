@@ -1,9 +1,19 @@
 import json
+import html as html_lib
 
-from lxml import html
+from lxml import html, etree
 
 from urllib.parse import urlparse
 
+from utils.client_async import MappedResponseBody
+
+# размер куска тела ответа, который передается lxml за раз (см. get_html_tree)
+HTML_FEED_CHUNK_SIZE = 64 * 1024
+
+_json_decoder = json.JSONDecoder()
+# парсеры для etree.fromstring (только для него парсер можно использовать повторно)
+_html_parsers = {}
+
 
 def get_host_from_url(url):
     url_struct = urlparse(url)
@@ -11,10 +21,131 @@ def get_host_from_url(url):
     return host
 
 
+def get_html_tree(content, encoding='utf-8'):
+    """
+    DOM из str или тела ответа (bytes, bytearray, MappedResponseBody),
+    для тела ответа кодировка задается явно, иначе lxml берет ее
+    из meta страницы, а без meta декодирует как latin-1
+    """
+    if isinstance(content, str):
+        return html.fromstring(content)
+    if isinstance(content, bytes):
+        parser = _html_parsers.get(encoding)
+        if parser is None:
+            parser = _html_parsers[encoding] = html.HTMLParser(encoding=encoding)
+        return etree.fromstring(content, parser=parser)
+    # из памяти lxml (4.5) разбирает только str и bytes, поэтому bytearray и mmap
+    # передаются парсеру кусками - копируется кусок, а не все тело,
+    # парсер для feed свой на каждый вызов: после ошибки в нем остается часть документа
+    parser = html.HTMLParser(encoding=encoding)
+    buffer = content.buffer if isinstance(content, MappedResponseBody) else memoryview(content)
+    with buffer as view:
+        for pos in range(0, len(view), HTML_FEED_CHUNK_SIZE):
+            parser.feed(view[pos:pos + HTML_FEED_CHUNK_SIZE].tobytes())
+    return parser.close()
+
+
+def get_jsondata(content, key, set_type_script=False, encoding='utf-8'):
+    """Сначала поиск без построения DOM, если не получилось - через lxml"""
+    data = find_json_after_key(content, key, encoding=encoding)
+    if data is None:
+        data = get_jsondata_from_html(content, key, set_type_script, encoding=encoding)
+    return data
+
+
+def find_json_after_key(content, key, open_sym='{', start=0,
+                        encoding='utf-8', max_gap=32, max_matches=10):
+    """
+    Поиск JSON, который идет в тексте страницы сразу после key
+    (например, window.key = {...}; или key: {...}), без построения DOM
+
+    content - str или тело ответа (bytes, bytearray, MappedResponseBody),
+    для тела ответа декодируется только кусок от начала JSON до конца тега script
+    конец JSON находит raw_decode (учитывает вложенность скобок и строки),
+    между key и открывающей скобкой не более max_gap символов
+
+    возвращает None, если JSON не найден - тогда надо искать через DOM
+    """
+    is_bytes = not isinstance(content, str)
+    if is_bytes:
+        key = key.encode(encoding)
+        open_sym = open_sym.encode(encoding)
+
+    pos = start
+    for _ in range(max_matches):
+        idx = content.find(key, pos)
+        if idx == -1:
+            return None
+        pos = idx + len(key)
+        idx_open = content.find(open_sym, pos, pos + max_gap)
+        if idx_open == -1:
+            continue
+        try:
+            if is_bytes:
+                idx_end = content.find(b'</script', idx_open)
+                if idx_end == -1:
+                    idx_end = len(content)
+                data, _ = _json_decoder.raw_decode(content[idx_open:idx_end].decode(encoding))
+            else:
+                data, _ = _json_decoder.raw_decode(content, idx_open)
+        except ValueError:  # в том числе UnicodeDecodeError
+            continue
+        return data
+    return None
+
+
+def find_json_in_attribute(content, marker, attr_name,
+                           tag='div', encoding='utf-8', max_matches=10):
+    """
+    Поиск JSON в атрибуте attr_name тега, в котором встречается marker
+    (например, <div id="state-webAddToCart-1" data-state='{...}'>), без построения DOM
+
+    возвращает None, если не найдено - тогда надо искать через DOM
+    """
+    if not isinstance(content, str):
+        marker = marker.encode(encoding)
+        attr_key = (attr_name + '=').encode(encoding)
+        tag_open = ('<' + tag).encode(encoding)
+        symbol_open = b'<'
+    else:
+        attr_key = attr_name + '='
+        tag_open = '<' + tag
+        symbol_open = '<'
+
+    pos = 0
+    for _ in range(max_matches):
+        idx = content.find(marker, pos)
+        if idx == -1:
+            return None
+        pos = idx + len(marker)
+        tag_start = content.rfind(symbol_open, 0, idx)
+        if tag_start == -1 or content[tag_start:tag_start+len(tag_open)] != tag_open:
+            continue
+        idx_attr = content.find(attr_key, tag_start)
+        # атрибут должен быть в том же теге
+        if idx_attr == -1 or content.find(symbol_open, tag_start + 1, idx_attr) != -1:
+            continue
+        idx_value = idx_attr + len(attr_key)
+        quote = content[idx_value:idx_value+1]
+        if quote not in ('"', "'", b'"', b"'"):
+            continue
+        idx_value_end = content.find(quote, idx_value + 1)
+        if idx_value_end == -1:
+            return None
+        value = content[idx_value+1:idx_value_end]
+        if not isinstance(value, str):
+            value = value.decode(encoding, errors='replace')
+        try:
+            return json.loads(html_lib.unescape(value))
+        except ValueError:
+            continue
+    return None
+
+
 def get_jsondata_from_html(content, key,
-                           set_type_script=False):
+                           set_type_script=False, encoding='utf-8'):
     """"""
-    tree = html.fromstring(content)
+    tree = get_html_tree(content, encoding)
     if set_type_script:
         scripts_find = tree.xpath("//script[@type='text/javascript']/text()")
     else:
@@ -55,6 +55,7 @@ class Product:
     shop_id: int = attr.ib(default=None)
     parent_id: int = attr.ib(default=None)
     id: int = attr.ib(default=None)
+    fingerprint: str = attr.ib(default=None)
 
     @classmethod
     def from_bd_records(cls, product_record, stock_records):
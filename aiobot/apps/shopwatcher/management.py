@@ -1,7 +1,17 @@
+import asyncio
+import logging
+
+from aiogram.utils.exceptions import RetryAfter, NetworkError, TelegramAPIError
+
 from apps.shopwatcher.bot import bot
 
 from .services import admin_service
 
+logger = logging.getLogger('service')
+
+# максимальная длина текста сообщения Telegram
+MESSAGE_MAX_LENGTH = 4096
+
 
 async def send_msg_admins(msg, is_html_mode=False):
     """Отправка сообщения администраторам"""
@@ -25,3 +35,185 @@ async def send_msg_user(user_id, msg):
         chat_id=user_id, text=msg,
         parse_mode='HTML', disable_web_page_preview=True
         )
+
+
+class TokenBucket:
+    """
+    Не более rate событий в секунду и не более capacity подряд (по умолчанию без всплесков),
+    pause(seconds) - никто не получает токен, пока не пройдет seconds (flood wait)
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or 1
+        self._tokens = self.capacity
+        self._updated = None
+        self._paused_until = 0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds):
+        loop = asyncio.get_running_loop()
+        self._paused_until = max(self._paused_until, loop.time() + seconds)
+
+    async def acquire(self):
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            while True:
+                time_now = loop.time()
+                if time_now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - time_now)
+                    continue
+                if self._updated is not None:
+                    self._tokens = min(self.capacity, self._tokens + (time_now - self._updated) * self.rate)
+                self._updated = time_now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class MessageDelivery:
+    """
+    Одновременная отправка сообщений с ограничениями Telegram:
+        rate - сообщений в секунду во все чаты (лимит рассылки около 30 в секунду),
+        chat_interval - секунд между сообщениями в один чат,
+        workers - сколько сообщений отправляется одновременно
+    RetryAfter (flood wait) останавливает всю отправку на указанное время,
+    сообщение отправляется повторно (не более max_retries раз, как и при сетевых ошибках),
+    остальные ошибки (бот заблокирован, чат не найден) только учитываются в статистике
+
+        async with MessageDelivery() as delivery:
+            await delivery.send(chat_id, text, parse_mode='HTML')
+        delivery.get_stats()
+
+    latency в статистике - от created (время loop.time(), по умолчанию - постановка в очередь)
+    до отправки, callback(is_sent) вызывается после отправки или окончательной ошибки
+    """
+    def __init__(self, rate=30, chat_interval=1.0, workers=10, queue_size=100, max_retries=3):
+        self.chat_interval = chat_interval
+        self.workers = workers
+        self.max_retries = max_retries
+        self._bucket = TokenBucket(rate)
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._chat_next = {}
+        self._tasks = []
+        self._time_start = None
+        self._time_end = None
+        self.count_sent = 0
+        self.count_failed = 0
+        self.count_retries = 0
+        self.count_flood_wait = 0
+        self._latency_sum = 0.0
+        self._latency_max = 0.0
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self._queue.join()
+        await self.stop()
+
+    def start(self):
+        self._time_start = asyncio.get_running_loop().time()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._time_end = asyncio.get_running_loop().time()
+
+    async def send(self, chat_id, text, parse_mode=None, created=None, callback=None):
+        """Постановка сообщения в очередь (ждет, если очередь заполнена)"""
+        if created is None:
+            created = asyncio.get_running_loop().time()
+        await self._queue.put((chat_id, text, parse_mode, created, callback))
+
+    def get_stats(self):
+        loop = asyncio.get_running_loop()
+        duration = (self._time_end or loop.time()) - (self._time_start or loop.time())
+        return {
+            'sent': self.count_sent,
+            'failed': self.count_failed,
+            'retries': self.count_retries,
+            'flood_wait': self.count_flood_wait,
+            'msg_per_sec': round(self.count_sent / duration, 2) if duration > 0 else None,
+            'latency_avg': round(self._latency_sum / self.count_sent, 3) if self.count_sent else None,
+            'latency_max': round(self._latency_max, 3),
+            }
+
+    async def _worker(self):
+        while True:
+            chat_id, text, parse_mode, created, callback = await self._queue.get()
+            is_sent = None
+            try:
+                await self._deliver(chat_id, text, parse_mode, created)
+                is_sent = True
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                is_sent = False
+                self.count_failed += 1
+                logger.error(f"Ошибка отправки сообщения в чат {chat_id}: {type(e)} {str(e)}")
+            finally:
+                # отправка прервана stop() - это не ошибка сообщения, callback не вызывается
+                if callback is not None and is_sent is not None:
+                    callback(is_sent)
+                self._queue.task_done()
+
+    async def _deliver(self, chat_id, text, parse_mode, created):
+        loop = asyncio.get_running_loop()
+        retries = 0
+        while True:
+            await self._wait_chat(chat_id)
+            await self._bucket.acquire()
+            try:
+                await bot.send_message(
+                    chat_id=chat_id, text=text,
+                    parse_mode=parse_mode, disable_web_page_preview=True
+                    )
+            except RetryAfter as e:
+                self.count_flood_wait += 1
+                self._bucket.pause(e.timeout)
+                self._chat_next[chat_id] = loop.time() + e.timeout
+                logger.warning(f"Telegram flood wait {e.timeout} сек (чат {chat_id})")
+            except NetworkError:
+                if retries >= self.max_retries:
+                    raise
+                await asyncio.sleep(2 ** retries)
+            else:
+                latency = loop.time() - created
+                self.count_sent += 1
+                self._latency_sum += latency
+                self._latency_max = max(self._latency_max, latency)
+                return
+
+            if retries >= self.max_retries:
+                raise TelegramAPIError(f"Сообщение не отправлено после {retries} повторов")
+            retries += 1
+            self.count_retries += 1
+
+    async def _wait_chat(self, chat_id):
+        """Соблюдение chat_interval для чата, время следующей отправки резервируется сразу"""
+        loop = asyncio.get_running_loop()
+        time_now = loop.time()
+        time_send = max(time_now, self._chat_next.get(chat_id, 0))
+        self._chat_next[chat_id] = time_send + self.chat_interval
+        if time_send > time_now:
+            await asyncio.sleep(time_send - time_now)
+
+
+def join_messages(texts, max_length=MESSAGE_MAX_LENGTH, separator='\n\n'):
+    """Объединение текстов в сообщения не длиннее max_length (длинный текст - отдельным сообщением)"""
+    messages = []
+    current = ''
+    for text in texts:
+        if current and len(current) + len(separator) + len(text) > max_length:
+            messages.append(current)
+            current = ''
+        current = f"{current}{separator}{text}" if current else text
+    if current:
+        messages.append(current)
+    return messages
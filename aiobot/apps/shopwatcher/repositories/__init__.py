@@ -1,4 +1,4 @@
-from .notice_repository import NoticeRepository, NoticeMessageRepository
+from .notice_repository import NoticeMessageRepository
 from .product_repository import ProductRepository, ProductSubRepository
 from .shop_repository import ShopRepository
 from .user_repository import UserRepository, AdminRepository
@@ -6,7 +6,7 @@ from .sub_repository import SubSaveRepository, SubUserRepository
 
 
 __all__ = (
-    'NoticeRepository', 'NoticeMessageRepository',
+    'NoticeMessageRepository',
     'ProductRepository', 'ProductSubRepository',
     'ShopRepository', 'UserRepository', 'AdminRepository',
     'SubSaveRepository', 'SubUserRepository',
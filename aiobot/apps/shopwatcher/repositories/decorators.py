@@ -1,11 +1,18 @@
-
 from functools import wraps
 from db import db_engine as db
+from db.aiopg import connection_ctx
 
 
 def db_connect_classmethod(method):
+    """
+    Коннекция из пула на время вызова метода,
+    внутри unit_of_work / begin_transaction - общая коннекция из ContextVar
+    """
     @wraps(method)
     async def decorated(self, *args, **kwargs):
+        current_connection = connection_ctx.get()
+        if current_connection is not None:
+            return await method(self, current_connection, *args, **kwargs)
         async with db.engine.acquire() as db_connection:
             return await method(self, db_connection, *args, **kwargs)
     return decorated
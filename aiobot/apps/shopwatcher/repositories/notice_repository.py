@@ -1,6 +1,8 @@
 import sqlalchemy as sa
 
-from sqlalchemy import func  # false, and_, tuple_,
+from datetime import timedelta
+
+from sqlalchemy import func, and_, or_  # false, tuple_,
 
 from db import db_engine as db
 
@@ -11,95 +13,24 @@ from apps.shopwatcher.tables import (
     sub_user_stock_ix, sub_user, notice_stock, notice_msg, StatusNoticeEnum
     )
 
-from .decorators import db_connect_classmethod
-
-
-class NoticeRepository:
-
-    @db_connect_classmethod
-    async def get_notice_stocks(self, db_connection, stock_ids):
-        query = notice_stock.select().where(notice_stock.c.stock_id.in_(stock_ids))
-        result = await db_connection.execute(query)
-        return await result.fetchall()
-
-    @db_connect_classmethod
-    async def save_notice_stocks(
-        self,
-        db_connection,
-        create_notice_data=None,
-        update_notice_data=None,
-        delete_notice_ids=None,
-    ):
-        async with db_connection.begin():
-            if create_notice_data:
-                await self._create_notice_stocks(db_connection, create_notice_data)
-            if update_notice_data:
-                await self._update_notice_stocks(db_connection, update_notice_data)
-            if delete_notice_ids:
-                await self._delete_notice_stocks(db_connection, delete_notice_ids)
-
-    async def _create_notice_stocks(self, db_connection, create_notice_data):
-        insert_vals = [
-            {'stock_id': stock_id, 'data': data}
-            for stock_id, data in create_notice_data.items()
-            ]
-        insert_q = notice_stock.insert().values(insert_vals)
-        await db_connection.execute(insert_q)
-
-    async def _update_notice_stocks(self, db_connection, update_notice_stock_data):
-        for stock_id, data in update_notice_stock_data.items():
-            update_q = notice_stock.update().values(data=data)\
-                .where(notice_stock.c.stock_id == stock_id)
-            await db_connection.execute(update_q)
-
-    async def _delete_notice_stocks(self, db_connection, notice_stock_ids):
-        delete_q = notice_stock.delete().where(notice_stock.c.id.in_(notice_stock_ids))
-        await db_connection.execute(delete_q)
-
 
 class NoticeMessageRepository:
 
-    async def create_notice_msgs(self, msgs):
-        async with db.engine.acquire() as db_connection:
-            query = notice_msg.insert().values(msgs)
-            await db_connection.execute(query)
-
-    async def notice_msg_for_send_iter(self):
-        bulk_size = 10
-        send_ids = []
-        while True:
-            dt_send = now()
-            async with db.engine.acquire() as db_connection:
-                # .where(notice_msg.c.dt_send.is_(None))\
-                query = sa.select((notice_msg.c.id, user.c.user_id_orig, user.c.first_name, notice_msg.c.text))\
-                    .select_from(notice_msg.join(user, user.c.id == notice_msg.c.user_id))\
-                    .where(notice_msg.c.status == StatusNoticeEnum.not_send.value)\
-                    .order_by(user.c.id)\
-                    .limit(bulk_size)
-                res = await db_connection.execute(query)
-                recs = await res.fetchall()
-
-            if len(recs) == 0:
-                break
-
-            send_ids.clear()
-            for item in recs:
-                yield item.user_id_orig, item.first_name, item.text
-                send_ids.append(item.id)
-
-            async with db.engine.acquire() as db_connection:
-                query = notice_msg.update().values(
-                    dt_send=dt_send, status=StatusNoticeEnum.in_progress.value
-                    )\
-                    .where(notice_msg.c.id.in_(send_ids))
-                await db_connection.execute(query)
-
-    async def get_notice_product_iter(self):
+    async def create_notice_msgs_from_stocks(self):
         """
+        Сообщения по всем изменениям из notice_stock одним запросом в БД,
+        группировка по (пользователь, товар) и данные для шаблона формируются в postgres,
+        текст формируется при отправке (см. NoticeMessageService.claim_messages)
+
+        INSERT INTO notice_msg (user_id, product_id, data, status, retry_count)
         SELECT
-        sub.user_id, p.id as product_id, p.name as product_name, p.url as product_url,
-        s.label as shop_label, p.parameters as product_parameters,
-        json_agg(json_build_object('data', ns.data, 'parameters', ps.parameters, 'discount', ps.discount))
+        sub.user_id, p.id,
+        jsonb_build_object(
+            'product_name', p.name, 'product_url', p.url, 'product_reference', p.reference,
+            'product_parameters', p.parameters, 'shop_label', s.label,
+            'notice_data', jsonb_agg(jsonb_build_object('data', ns.data, 'parameters', ps.parameters,
+                                                        'discount', ps.discount))
+        ), 0, 0
         FROM sub_user_stock_ix as subi
         INNER JOIN notice_stock as ns ON ns.stock_id = subi.stock_id
         INNER JOIN sub_user as sub ON sub.id = subi.sub_id
@@ -109,38 +40,112 @@ class NoticeMessageRepository:
         GROUP BY sub.user_id, p.id, s.id
         ORDER BY sub.user_id, p.id
         """
+        query = sa.select((
+                sub_user.c.user_id,
+                product.c.id,
+                func.jsonb_build_object(
+                    'product_name', product.c.name,
+                    'product_url', product.c.url,
+                    'product_reference', product.c.reference,
+                    'product_parameters', product.c.parameters,
+                    'shop_label', shop.c.label,
+                    'notice_data', func.jsonb_agg(func.jsonb_build_object(
+                        'data', notice_stock.c.data,
+                        'parameters', product_stock.c.parameters,
+                        'discount', product_stock.c.discount,
+                        )),
+                    ),
+                ))\
+            .select_from(
+                sub_user_stock_ix
+                .join(notice_stock, notice_stock.c.stock_id == sub_user_stock_ix.c.stock_id)
+                .join(sub_user, sub_user.c.id == sub_user_stock_ix.c.sub_id)
+                .join(product_stock, product_stock.c.id == sub_user_stock_ix.c.stock_id)
+                .join(product, product.c.id == product_stock.c.product_id)
+                .join(shop, shop.c.id == product.c.shop_id)
+                )\
+            .group_by(sub_user.c.user_id, product.c.id, shop.c.id)\
+            .order_by(sub_user.c.user_id, product.c.id)
+        # status и retry_count - значения по умолчанию из описания таблицы
+        insert_q = notice_msg.insert().from_select(('user_id', 'product_id', 'data'), query)
         async with db.engine.acquire() as db_connection:
-            select_exists = sa.select((sa.exists(sa.select((notice_stock.c.stock_id, ))),))
-            res = await db_connection.execute(select_exists)
-            exists = await res.scalar()
-            if not exists:
-                return
+            await db_connection.execute(insert_q)
 
-            query = sa.select((
-                    sub_user.c.user_id,
-                    product.c.id.label('product_id'), product.c.name.label('product_name'),
-                    product.c.reference.label('product_reference'), product.c.url.label('product_url'),
-                    product.c.parameters.label('product_parameters'),
-                    func.json_agg(func.json_build_object(
-                                    'data', notice_stock.c.data,
-                                    'parameters', product_stock.c.parameters,
-                                    'discount', product_stock.c.discount,
-                                    )).label('notice_data'),
-                    shop.c.label.label('shop_label')
-                    ))\
-                .select_from(
-                    sub_user_stock_ix
-                    .join(notice_stock, notice_stock.c.stock_id == sub_user_stock_ix.c.stock_id)
-                    .join(sub_user, sub_user.c.id == sub_user_stock_ix.c.sub_id)
-                    .join(product_stock, product_stock.c.id == sub_user_stock_ix.c.stock_id)
-                    .join(product, product.c.id == product_stock.c.product_id)
-                    .join(shop, shop.c.id == product.c.shop_id)
-                    )\
-                .group_by(sub_user.c.user_id, product.c.id, shop.c.id)\
-                .order_by(sub_user.c.user_id, product.c.id)
+    async def claim_notice_msgs(self, limit, retry_delay):
+        """
+        Захват до limit неотправленных сообщений одним запросом:
+            UPDATE notice_msg SET status = in_progress, dt_send = now
+            FROM auth_user
+            WHERE notice_msg.id IN (
+                SELECT id FROM notice_msg WHERE status = not_send ... LIMIT limit FOR UPDATE SKIP LOCKED
+            ) AND auth_user.id = notice_msg.user_id
+            RETURNING ...
+        строки, захваченные другим отправителем, пропускаются (SKIP LOCKED),
+        поэтому несколько отправителей не получат одно сообщение дважды
+        сообщения после неудачной попытки захватываются не раньше, чем через retry_delay секунд
+        """
+        return await self._claim_notice_msgs(retry_delay, limit=limit)
+
+    async def claim_user_notice_msgs(self, user_ids, retry_delay):
+        """Захват всех неотправленных сообщений пользователей user_ids (для дайджеста)"""
+        return await self._claim_notice_msgs(retry_delay, notice_msg.c.user_id.in_(user_ids))
+
+    async def _claim_notice_msgs(self, retry_delay, condition=None, limit=None):
+        dt_claim = now()
+        conditions = [
+            notice_msg.c.status == StatusNoticeEnum.not_send.value,
+            or_(notice_msg.c.dt_send.is_(None),
+                notice_msg.c.dt_send < dt_claim - timedelta(seconds=retry_delay)),
+            ]
+        if condition is not None:
+            conditions.append(condition)
+        claim_q = sa.select((notice_msg.c.id, ))\
+            .where(and_(*conditions))\
+            .order_by(notice_msg.c.id)\
+            .limit(limit)\
+            .with_for_update(skip_locked=True)
+        query = notice_msg.update()\
+            .values(status=StatusNoticeEnum.in_progress.value, dt_send=dt_claim)\
+            .where(and_(notice_msg.c.id.in_(claim_q), user.c.id == notice_msg.c.user_id))\
+            .returning(notice_msg.c.id, notice_msg.c.user_id, user.c.user_id_orig, user.c.first_name,
+                       user.c.notice_digest, notice_msg.c.text, notice_msg.c.data)
+        async with db.engine.acquire() as db_connection:
+            res = await db_connection.execute(query)
+            return await res.fetchall()
 
-            async for row in db_connection.execute(query):
-                yield row
+    async def finalize_notice_msgs(self, sent_ids, failed_ids, max_attempts):
+        """
+        sent_ids - отправлены (sended),
+        failed_ids - снова not_send с увеличенным retry_count, после max_attempts попыток - failed
+        """
+        async with db.engine.acquire() as db_connection:
+            if sent_ids:
+                query = notice_msg.update()\
+                    .values(status=StatusNoticeEnum.sended.value, dt_send=now())\
+                    .where(notice_msg.c.id.in_(sent_ids))
+                await db_connection.execute(query)
+            if failed_ids:
+                query = notice_msg.update()\
+                    .values(
+                        retry_count=notice_msg.c.retry_count + 1,
+                        status=sa.case(
+                            [(notice_msg.c.retry_count + 1 >= max_attempts, StatusNoticeEnum.failed.value)],
+                            else_=StatusNoticeEnum.not_send.value
+                            )
+                        )\
+                    .where(notice_msg.c.id.in_(failed_ids))
+                await db_connection.execute(query)
+
+    async def release_stale_notice_msgs(self, claim_timeout):
+        """Возврат в очередь сообщений, захваченных более claim_timeout секунд назад (отправитель упал)"""
+        query = notice_msg.update()\
+            .values(status=StatusNoticeEnum.not_send.value, dt_send=None)\
+            .where(and_(
+                notice_msg.c.status == StatusNoticeEnum.in_progress.value,
+                notice_msg.c.dt_send < now() - timedelta(seconds=claim_timeout)
+                ))
+        async with db.engine.acquire() as db_connection:
+            await db_connection.execute(query)
 
     async def delete_all_notice_stocks(self):
         delete_q = notice_stock.delete()
@@ -1,15 +1,19 @@
 import sqlalchemy as sa
 
-from sqlalchemy import and_
+from sqlalchemy import and_, or_, tuple_
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, insert as pg_insert
 
 
 from apps.shopwatcher.tables import (
-    product, price_history,
+    product, price_history, notice_stock,
     product_stock, sub_user, shop, sub_user_stock_ix
     )
 from utils.timezone import now
 from core.exceptions import ObjectDoesNotExist, PermissionDenied
 from db import db_engine as db
+from db.aiopg import unit_of_work
+from db.statements import Statement
+from db.values import Values
 
 
 from .decorators import db_connect_classmethod
@@ -17,106 +21,237 @@ from ..datacls import Product
 
 
 class ProductRepository:
+    _get_stocks_by_product_ids = Statement(
+        sa.select((
+            product_stock.c.product_id,
+            product_stock.c.id, product_stock.c.sku, product_stock.c.available,
+            product_stock.c.parameters, product_stock.c.price_base, product_stock.c.price_sale,
+            product_stock.c.price_card, product_stock.c.discount,
+            ))
+        .where(product_stock.c.product_id == sa.any_(sa.bindparam('product_ids', type_=ARRAY(sa.Integer))))
+        )
+
+    def begin(self):
+        """Все вызовы методов внутри - на одной коннекции в одной транзакции"""
+        return unit_of_work(db)
 
     @db_connect_classmethod
-    async def get_product_by_reference(self, db_connection, reference, shop_id):
+    async def get_product_fingerprints(self, db_connection):
+        """{(shop_id, reference): (product_id, fingerprint)} для товаров с сохраненным fingerprint"""
         query = sa.select((
-            product.c.id, product.c.name, product.c.url, product.c.url_parse,
-            product.c.reference, product.c.shop_id, product.c.parent_id,
-            product.c.parameters
+            product.c.id, product.c.shop_id, product.c.reference, product.c.fingerprint
             ))\
             .where(and_(
-                product.c.reference == reference,
-                product.c.shop_id == shop_id
+                product.c.fingerprint.isnot(None),
+                product.c.reference.isnot(None)
                 ))
         res = await db_connection.execute(query)
-        # возвращает None, если нет записи
-        product_record = await res.first()
-        if not product_record:
-            raise ObjectDoesNotExist
+        rows = await res.fetchall()
+        return {(row.shop_id, row.reference): (row.id, row.fingerprint) for row in rows}
+
+    @db_connect_classmethod
+    async def get_products_by_references(self, db_connection, keys):
+        """
+        {(shop_id, reference): Product} для всех найденных товаров из keys
+        двумя запросами (товары и их stocks) на весь список
+        """
+        keys = set(keys)
+        if not keys:
+            return {}
+        conditions = []
+        keys_ref = [key for key in keys if key[1] is not None]
+        if keys_ref:
+            conditions.append(tuple_(product.c.shop_id, product.c.reference).in_(keys_ref))
+        shop_ids_no_ref = [shop_id for shop_id, reference in keys if reference is None]
+        if shop_ids_no_ref:
+            conditions.append(and_(
+                product.c.shop_id.in_(shop_ids_no_ref), product.c.reference.is_(None)
+                ))
 
         query = sa.select((
-            product_stock.c.id, product_stock.c.sku, product_stock.c.available,
-            product_stock.c.parameters, product_stock.c.price_base, product_stock.c.price_sale,
-            product_stock.c.price_card, product_stock.c.discount,
+            product.c.id, product.c.name, product.c.url, product.c.url_parse,
+            product.c.reference, product.c.shop_id, product.c.parent_id,
+            product.c.parameters, product.c.fingerprint
             ))\
-            .where(product_stock.c.product_id == product_record.id)
-
+            .where(or_(*conditions))
         res = await db_connection.execute(query)
-        stock_records = await res.fetchall()
-        return Product.from_bd_records(product_record, stock_records)
+        product_records = await res.fetchall()
+        if not product_records:
+            return {}
 
-    @db_connect_classmethod
-    async def create_product_and_stocks(self, db_connection, product_obj):
-        async with db_connection.begin():
-            product_id = await self._create_product(db_connection, product_obj)
-            if product_obj.stocks:
-                await self._create_product_stocks(db_connection, product_id, product_obj.stocks)
-            return product_id
+        res = await self._get_stocks_by_product_ids.execute(
+            db_connection, product_ids=[item.id for item in product_records]
+            )
+        stock_records = {}
+        for row in await res.fetchall():
+            stock_data = dict(row)
+            stock_records.setdefault(stock_data.pop('product_id'), []).append(stock_data)
+
+        products = {}
+        for product_record in product_records:
+            product_obj = Product.from_bd_records(product_record, stock_records.get(product_record.id, []))
+            product_obj.fingerprint = product_record.fingerprint
+            products[(product_record.shop_id, product_record.reference)] = product_obj
+        return products
 
     @db_connect_classmethod
-    async def update_product_and_stocks(
+    async def save_products(
         self,
         db_connection,
-        product_id,
-        update_product_data,
-        stocks_create,
-        stocks_update_data,
-        stocks_delete_ids,
-        set_available
+        products_create=None,
+        products_update=None,
+        stocks_create=None,
+        stocks_update=None,
+        stocks_delete_ids=None,
+        stocks_unavailable_ids=None,
+        price_history_stocks=None,
+        notice_data=None,
     ) -> None:
+        """
+        Сохранение изменений нескольких товаров в одной транзакции,
+        на каждый вид изменений один запрос на все товары:
+            products_create - [(Product, parent)], parent - Product родителя или None,
+                если родитель создается в этой же транзакции, то он должен быть в products_create,
+                созданным товарам проставляется id, их stocks тоже создаются
+            products_update - [(Product, parent)], обновляются все поля товара
+            stocks_create - [(product_id, ProductStock)]
+            stocks_update - [ProductStock] с id и актуальными значениями всех полей
+            stocks_delete_ids - stocks, которые удаляются
+            stocks_unavailable_ids - stocks, которые становятся недоступными (available=False)
+            price_history_stocks - [ProductStock] с ценами до изменения
+            notice_data - {stock_id: data} для notice_stock, объединяется с уже сохраненными
+        """
+        stocks_create = list(stocks_create or [])
         async with db_connection.begin():
-            if update_product_data:
-                await self._update_product(db_connection, product_id, update_product_data)
+            if products_create:
+                await self._create_products(db_connection, products_create)
+                for product_obj, _ in products_create:
+                    stocks_create.extend((product_obj.id, stock) for stock in product_obj.stocks)
+            if products_update:
+                await self._update_products(db_connection, products_update)
             if stocks_create:
-                await self._create_product_stocks(db_connection, product_id, stocks_create)
-            if stocks_update_data:
-                await self._update_product_stock(db_connection, stocks_update_data)
+                await self._create_product_stocks(db_connection, stocks_create)
+            if stocks_update:
+                await self._update_product_stocks(db_connection, stocks_update)
             if stocks_delete_ids:
-                await self._delete_product_stock(db_connection, stocks_delete_ids, set_available)
+                await self._delete_product_stock(db_connection, stocks_delete_ids, set_available=True)
+            if stocks_unavailable_ids:
+                await self._delete_product_stock(db_connection, stocks_unavailable_ids)
+            if price_history_stocks:
+                await self._create_price_history(db_connection, price_history_stocks)
+            if notice_data:
+                await self._upsert_notice_stocks(db_connection, notice_data)
+
+    async def _create_products(self, db_connection, products_create):
+        """
+        Родители создаются раньше дочерних товаров: в каждом проходе один INSERT
+        для товаров, родитель которых уже есть в БД
 
-    @db_connect_classmethod
-    async def create_price_history(self, db_connection, stock):
-        query = price_history.insert().values(
-            product_stock_id=stock.id,
-            price_base=stock.price_base,
-            price_sale=stock.price_sale,
-            price_card=stock.price_card,
-            dt=now()
-            )
+        INSERT ... ON CONFLICT (shop_id, reference): если товар успели создать параллельно
+        (парсинг по расписанию и запрос пользователя), то он обновляется и возвращается его id
+        """
+        pending = list(products_create)
+        while pending:
+            ready = [item for item in pending if item[1] is None or item[1].id is not None]
+            if not ready:
+                raise ValueError('parent product must be created in the same batch')
+            insert_values = []
+            for product_obj, parent in ready:
+                if parent is not None:
+                    product_obj.parent_id = parent.id
+                insert_values.append({
+                    'shop_id': product_obj.shop_id, 'parent_id': product_obj.parent_id,
+                    'name': product_obj.name, 'url': product_obj.url,
+                    'url_parse': product_obj.url_parse, 'reference': product_obj.reference,
+                    'parameters': product_obj.parameters, 'fingerprint': product_obj.fingerprint
+                    })
+            query = pg_insert(product).values(insert_values)
+            excluded = query.excluded
+            query = query.on_conflict_do_update(
+                index_elements=[product.c.shop_id, product.c.reference],
+                set_={
+                    'parent_id': excluded.parent_id, 'name': excluded.name, 'url': excluded.url,
+                    'url_parse': excluded.url_parse, 'parameters': excluded.parameters,
+                    'fingerprint': excluded.fingerprint
+                    }
+                )\
+                .returning(product.c.id, product.c.shop_id, product.c.reference)
+            res = await db_connection.execute(query)
+            # порядок строк RETURNING не гарантирован - id сопоставляются по (shop_id, reference)
+            product_ids = {(row.shop_id, row.reference): row.id for row in await res.fetchall()}
+            for product_obj, _ in ready:
+                product_obj.id = product_ids[(product_obj.shop_id, product_obj.reference)]
+            pending = [item for item in pending if item[0].id is None]
+
+    async def _update_products(self, db_connection, products_update):
+        rows = []
+        for product_obj, parent in products_update:
+            if parent is not None:
+                product_obj.parent_id = parent.id
+            rows.append((
+                product_obj.id, product_obj.name, product_obj.url, product_obj.url_parse,
+                product_obj.parameters, product_obj.parent_id, product_obj.fingerprint
+                ))
+        values = Values([
+            sa.column('id', product.c.id.type), sa.column('name', product.c.name.type),
+            sa.column('url', product.c.url.type), sa.column('url_parse', product.c.url_parse.type),
+            sa.column('parameters', product.c.parameters.type),
+            sa.column('parent_id', product.c.parent_id.type),
+            sa.column('fingerprint', product.c.fingerprint.type),
+            ], rows, 'v')
+        query = product.update().values(
+            name=values.c.name, url=values.c.url, url_parse=values.c.url_parse,
+            parameters=values.c.parameters, parent_id=values.c.parent_id,
+            fingerprint=values.c.fingerprint
+            )\
+            .where(product.c.id == values.c.id)
         await db_connection.execute(query)
 
-    async def _create_product(self, db_connection, product_obj):
-        product_create_q = product.insert().values(
-            shop_id=product_obj.shop_id, parent_id=product_obj.parent_id,
-            name=product_obj.name, url=product_obj.url,
-            url_parse=product_obj.url_parse, reference=product_obj.reference,
-            parameters=product_obj.parameters
-            )
-        res_insert = await db_connection.execute(product_create_q)
-        return await res_insert.scalar()
-
-    async def _create_product_stocks(self, db_connection, product_id: int, stocks: list):
-        insert_values = [{
+    async def _create_product_stocks(self, db_connection, stocks):
+        """
+        INSERT ... ON CONFLICT (product_id, sku) - stock, созданный параллельно, обновляется,
+        одинаковые sku товара в данных парсинга сохраняются один раз (последний)
+        """
+        insert_values = {(product_id, item.sku): {
             'product_id': product_id, 'sku': item.sku,
             'available': item.available, 'discount': item.discount,
             'price_base': item.price_base, 'price_sale': item.price_sale,
             'price_card': item.price_card, 'parameters': item.parameters,
-            } for item in stocks]
-        query = product_stock.insert().values(insert_values)
+            } for product_id, item in stocks}
+        query = pg_insert(product_stock).values(list(insert_values.values()))
+        excluded = query.excluded
+        query = query.on_conflict_do_update(
+            index_elements=[product_stock.c.product_id, product_stock.c.sku],
+            set_={
+                'available': excluded.available, 'discount': excluded.discount,
+                'price_base': excluded.price_base, 'price_sale': excluded.price_sale,
+                'price_card': excluded.price_card, 'parameters': excluded.parameters
+                }
+            )
         await db_connection.execute(query)
 
-    async def _update_product(self, db_connection, product_id, update_data):
-        query = product.update().values(**update_data)\
-            .where(product.c.id == product_id)
+    async def _update_product_stocks(self, db_connection, stocks):
+        rows = [(
+            item.id, item.available, item.discount,
+            item.price_base, item.price_sale, item.price_card, item.parameters
+            ) for item in stocks]
+        values = Values([
+            sa.column('id', product_stock.c.id.type),
+            sa.column('available', product_stock.c.available.type),
+            sa.column('discount', product_stock.c.discount.type),
+            sa.column('price_base', product_stock.c.price_base.type),
+            sa.column('price_sale', product_stock.c.price_sale.type),
+            sa.column('price_card', product_stock.c.price_card.type),
+            sa.column('parameters', product_stock.c.parameters.type),
+            ], rows, 'v')
+        query = product_stock.update().values(
+            available=values.c.available, discount=values.c.discount,
+            price_base=values.c.price_base, price_sale=values.c.price_sale,
+            price_card=values.c.price_card, parameters=values.c.parameters
+            )\
+            .where(product_stock.c.id == values.c.id)
         await db_connection.execute(query)
 
-    async def _update_product_stock(self, db_connection, update_data):
-        for stock_id, stock_data in update_data.items():
-            query = product_stock.update().values(**stock_data)\
-                .where(product_stock.c.id == stock_id)
-            await db_connection.execute(query)
-
     async def _delete_product_stock(self, db_connection, stock_ids, set_available=False):
         if set_available:
             query = product_stock.delete().where(product_stock.c.id.in_(stock_ids))
@@ -125,20 +260,94 @@ class ProductRepository:
                 .where(product_stock.c.id.in_(stock_ids))
         await db_connection.execute(query)
 
+    async def _create_price_history(self, db_connection, stocks):
+        dt = now()
+        insert_values = [{
+            'product_stock_id': item.id,
+            'price_base': item.price_base, 'price_sale': item.price_sale,
+            'price_card': item.price_card, 'dt': dt
+            } for item in stocks]
+        query = price_history.insert().values(insert_values)
+        await db_connection.execute(query)
 
-class ProductSubRepository:
+    async def _upsert_notice_stocks(self, db_connection, notice_data):
+        """
+        Если для stock уже есть оповещение, то оно меняется только при изменении цены:
+        цены объединяются (старые ключи остаются, одинаковые заменяются новыми),
+        оповещение о доступности заменяется оповещением о цене
+        """
+        query = pg_insert(notice_stock).values([
+            {'stock_id': stock_id, 'data': data} for stock_id, data in notice_data.items()
+            ])
+        excluded = query.excluded
+        data_merged = sa.case(
+            [(notice_stock.c.data.has_key('price'),
+              sa.func.jsonb_build_object(
+                  'price', notice_stock.c.data['price'].op('||')(excluded.data['price']),
+                  type_=JSONB
+                  ))],
+            else_=excluded.data
+            )
+        query = query.on_conflict_do_update(
+            index_elements=[notice_stock.c.stock_id],
+            set_={'data': data_merged},
+            where=excluded.data.has_key('price')
+            )
+        await db_connection.execute(query)
 
-    @db_connect_classmethod
-    async def get_product_for_sub(self, db_connection, sub_id, user_id):
-        query = sa.select((
+
+class ProductSubRepository:
+    _get_products_for_parse = Statement(
+        sa.select((
+            product.c.id, product.c.url_parse, product.c.url, shop.c.parse_params,
+            shop.c.id.label('shop_id'), shop.c.name.label('shop_name')
+            ))
+        .select_from(
+            product
+            .join(sub_user, sub_user.c.product_id == product.c.id)
+            .join(shop, product.c.shop_id == shop.c.id)
+            )
+        .where(product.c.id > sa.bindparam('last_id'))
+        .group_by(product.c.id, shop.c.id)
+        .order_by(product.c.id)
+        .limit(sa.bindparam('limit', type_=sa.Integer))
+        )
+    _get_product_for_sub = Statement(
+        sa.select((
             product.c.id, product.c.name, product.c.shop_id, product.c.reference,
             product.c.url, product.c.url_parse, product.c.parameters, product.c.parent_id,
             sub_user.c.user_id
-            ))\
-            .select_from(sub_user.join(product, product.c.id == sub_user.c.product_id))\
-            .where(sub_user.c.id == sub_id)
+            ))
+        .select_from(sub_user.join(product, product.c.id == sub_user.c.product_id))
+        .where(sub_user.c.id == sa.bindparam('sub_id'))
+        )
+    _get_product_stocks = Statement(
+        sa.select((
+            product_stock.c.id, product_stock.c.sku, product_stock.c.available,
+            product_stock.c.parameters, product_stock.c.price_base, product_stock.c.price_sale,
+            product_stock.c.price_card, product_stock.c.discount,
+            ))
+        .where(product_stock.c.product_id == sa.bindparam('product_id'))
+        )
+    _get_product_parameters_for_sub = Statement(
+        sa.select((product.c.id, product.c.parameters, sub_user.c.user_id))
+        .select_from(sub_user
+                     .join(sub_user_stock_ix, sub_user_stock_ix.c.sub_id == sub_user.c.id)
+                     .join(product_stock, product_stock.c.id == sub_user_stock_ix.c.stock_id)
+                     .join(product, product.c.id == product_stock.c.product_id)
+                     )
+        .where(sub_user.c.id == sa.bindparam('sub_id'))
+        .group_by(product.c.id, sub_user.c.id)
+        )
+    _get_product_stocks_parameters = Statement(
+        sa.select((product_stock.c.parameters, ))
+        .where(product_stock.c.product_id == sa.bindparam('product_id'))
+        .order_by(product_stock.c.id)
+        )
 
-        res = await db_connection.execute(query)
+    @db_connect_classmethod
+    async def get_product_for_sub(self, db_connection, sub_id, user_id):
+        res = await self._get_product_for_sub.execute(db_connection, sub_id=sub_id)
         product_record = await res.first()
 
         if not product_record:
@@ -152,28 +361,12 @@ class ProductSubRepository:
         return product_obj
 
     async def _get_product_stock_rows(self, db_connection, product_id):
-        query = sa.select((
-            product_stock.c.id, product_stock.c.sku, product_stock.c.available,
-            product_stock.c.parameters, product_stock.c.price_base, product_stock.c.price_sale,
-            product_stock.c.price_card, product_stock.c.discount,
-            ))\
-            .where(product_stock.c.product_id == product_id)
-
-        res = await db_connection.execute(query)
+        res = await self._get_product_stocks.execute(db_connection, product_id=product_id)
         return await res.fetchall()
 
     @db_connect_classmethod
     async def get_product_parameters_and_stocks_for_sub(self, db_connection, sub_id, user_id):
-        query = sa.select((product.c.id, product.c.parameters, sub_user.c.user_id))\
-            .select_from(sub_user
-                         .join(sub_user_stock_ix, sub_user_stock_ix.c.sub_id == sub_user.c.id)
-                         .join(product_stock, product_stock.c.id == sub_user_stock_ix.c.stock_id)
-                         .join(product, product.c.id == product_stock.c.product_id)
-                         )\
-            .where(sub_user.c.id == sub_id)\
-            .group_by(product.c.id, sub_user.c.id)
-
-        res = await db_connection.execute(query)
+        res = await self._get_product_parameters_for_sub.execute(db_connection, sub_id=sub_id)
         row = await res.first()
 
         if not row:
@@ -184,43 +377,37 @@ class ProductSubRepository:
         product_id = row.id
         product_parameters = row.parameters
 
-        query = sa.select((product_stock.c.parameters, ))\
-            .where(product_stock.c.product_id == product_id)\
-            .order_by(product_stock.c.id)
-
-        res = await db_connection.execute(query)
+        res = await self._get_product_stocks_parameters.execute(db_connection, product_id=product_id)
         product_stocks = await res.fetchall()
 
         return product_id, product_parameters, product_stocks
 
-    # нужно другой декоратор писать с проверкой AsyncGeneratorType
-    # https://stackoverflow.com/questions/54712966/asynchronous-decorator-for-both-generators-and-coroutines
-    # @db_connect_classmethod
-    # async def get_product_for_sub_iter(self, db_connection):
     async def get_product_for_sub_iter(self):
         """
         Парсим только те товары, на которые есть подписка
 
+        товары читаются порциями по stream_fetch_size (keyset по id), для каждой порции
+        коннекция берется из пула ненадолго - обход очереди парсинга идет часами
+        и не должен держать коннекцию и открытую транзакцию (снимок мешает vacuum)
+
         SELECT pr.id, pr.url_parse, pr.url, sh.name
         --pr.*, sh.name
         FROM product as pr
         INNER JOIN sub_user as ps ON ps.product_id = pr.id
         INNER JOIN shop as sh ON sh.id = pr.shop_id
+        WHERE pr.id > :last_id
         GROUP BY pr.id, sh.id
-        ORDER BY pr.id;
+        ORDER BY pr.id
+        LIMIT :limit;
         """
-        async with db.engine.acquire() as db_connection:
-            query = sa.select((
-                product.c.url_parse, product.c.url, shop.c.parse_params,
-                shop.c.id.label('shop_id'), shop.c.name.label('shop_name')
-                ))\
-                .select_from(
-                    product
-                    .join(sub_user, sub_user.c.product_id == product.c.id)
-                    .join(shop, product.c.shop_id == shop.c.id)
-                    )\
-                .group_by(product.c.id, shop.c.id)\
-                .order_by(product.c.id)
-
-            async for row in db_connection.execute(query):
+        last_id = 0
+        while True:
+            async with db.engine.acquire() as db_connection:
+                res = await self._get_products_for_parse.execute(
+                    db_connection, last_id=last_id, limit=db.stream_fetch_size)
+                rows = await res.fetchall()
+            for row in rows:
                 yield row
+            if len(rows) < db.stream_fetch_size:
+                break
+            last_id = rows[-1].id
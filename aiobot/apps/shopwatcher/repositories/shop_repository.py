@@ -6,19 +6,23 @@ from core.exceptions import ObjectDoesNotExist
 
 from apps.shopwatcher.tables import shop
 
+from db.statements import Statement
+
 from ..datacls import Shop
 from .decorators import db_connect_classmethod
 
 
 class ShopRepository:
+    _get_shop_by_domain = Statement(
+        sa.select((shop.c.id, shop.c.name, shop.c.domain, shop.c.url, shop.c.label, shop.c.parse_params))
+        .where(and_(shop.c.domain == sa.bindparam('domain'), shop.c.enabled == sa.true()))
+        )
 
     @db_connect_classmethod
     async def get_shop_by_domain(
         self, db_connection, domain: str
     ) -> Shop:
-        query = sa.select((shop.c.id, shop.c.name, shop.c.domain, shop.c.url, shop.c.label, shop.c.parse_params))\
-            .where(and_(shop.c.domain == domain, shop.c.enabled == sa.true()))
-        res = await db_connection.execute(query)
+        res = await self._get_shop_by_domain.execute(db_connection, domain=domain)
         row = await res.first()
         if not row:
             raise ObjectDoesNotExist('shop with domain %s does not exist' % domain)
@@ -8,20 +8,23 @@ from apps.shopwatcher.tables import (
     user, user_group_ix, group, GroupEnum
     )
 from core.exceptions import ObjectDoesNotExist
+from db.statements import Statement
 
 from ..datacls import User
 from .decorators import db_connect_classmethod
 
 
 class UserRepository:
+    _get_user_by_orig_id = Statement(
+        sa.select((user.c.id, user.c.user_id_orig, user.c.first_name))
+        .where(user.c.user_id_orig == sa.bindparam('user_id_orig'))
+        )
 
     @db_connect_classmethod
     async def get_user_by_orig_id(
         self, db_connection, user_id_orig: int
     ) -> User:
-        query = sa.select((user.c.id, user.c.user_id_orig, user.c.first_name))\
-            .where(user.c.user_id_orig == user_id_orig)
-        res = await db_connection.execute(query)
+        res = await self._get_user_by_orig_id.execute(db_connection, user_id_orig=user_id_orig)
         row = await res.first()
         if not row:
             raise ObjectDoesNotExist(
@@ -41,6 +44,17 @@ class UserRepository:
         user_obj.id = await res_insert.scalar()
         return user_obj
 
+    @db_connect_classmethod
+    async def toggle_notice_digest(
+        self, db_connection, user_id: int
+    ) -> bool:
+        query = user.update()\
+            .values(notice_digest=sa.not_(user.c.notice_digest))\
+            .where(user.c.id == user_id)\
+            .returning(user.c.notice_digest)
+        res = await db_connection.execute(query)
+        return await res.scalar()
+
 
 class AdminRepository:
 
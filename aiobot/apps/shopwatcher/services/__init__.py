@@ -7,7 +7,7 @@ from .exceptions import HandleMessageError, HandleProductError, DeserializeProdu
 
 from ..repositories import (
     ProductRepository, ProductSubRepository,
-    NoticeRepository, NoticeMessageRepository,
+    NoticeMessageRepository,
     ShopRepository, UserRepository, AdminRepository,
     SubSaveRepository, SubUserRepository
     )
@@ -27,7 +27,7 @@ __all__ = (
     )
 
 
-product_service = ProductService(ProductRepository(), NoticeRepository())
+product_service = ProductService(ProductRepository())
 product_sub_service = ProductSubService(ProductSubRepository())
 notice_msg_service = NoticeMessageService(NoticeMessageRepository())
 shop_service = ShopService(ShopRepository())
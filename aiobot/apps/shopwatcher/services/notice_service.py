@@ -9,51 +9,72 @@ class NoticeMessageService:
     def __init__(self, notice_msg_repository) -> None:
         self._notice_msg_repository = notice_msg_repository
 
-    async def get_message_iter(self):
-        async for user_id, user_name, text in self._notice_msg_repository.notice_msg_for_send_iter():
-            yield user_id, user_name, text
+    async def claim_messages(self, limit=100, retry_delay=600, max_length=4096):
+        """
+        Захват пачки сообщений для отправки: [(msg_ids, user_id, user_name, text)]
+        текст формируется здесь по данным сообщения (data), после отправки нужно вызвать finalize_messages
+        для всех msg_ids
+
+        пользователям с notice_digest все их неотправленные сообщения (в том числе не попавшие в пачку)
+        объединяются в дайджест - как можно меньше сообщений не длиннее max_length
+        """
+        rows = await self._notice_msg_repository.claim_notice_msgs(limit, retry_delay)
+        digest_user_ids = {row.user_id for row in rows if row.notice_digest}
+        if digest_user_ids:
+            rows += await self._notice_msg_repository.claim_user_notice_msgs(
+                list(digest_user_ids), retry_delay)
+
+        messages = []
+        digest_rows = {}
+        for row in rows:
+            if row.notice_digest and row.data is not None:
+                digest_rows.setdefault(row.user_id, []).append(row)
+                continue
+            text = row.text
+            if text is None:
+                text = self._get_text_msg(self._get_context_msg(row.data))
+            messages.append(([row.id], row.user_id_orig, row.first_name, text))
+
+        for user_rows in digest_rows.values():
+            user_row = user_rows[0]
+            user_rows.sort(key=lambda row: row.id)
+            for msg_ids, text in self._get_digest_msgs(user_rows, max_length):
+                messages.append((msg_ids, user_row.user_id_orig, user_row.first_name, text))
+        return messages
+
+    async def finalize_messages(self, sent_ids, failed_ids, max_attempts=3):
+        await self._notice_msg_repository.finalize_notice_msgs(sent_ids, failed_ids, max_attempts)
+
+    async def release_stale_messages(self, claim_timeout=3600):
+        await self._notice_msg_repository.release_stale_notice_msgs(claim_timeout)
 
     async def clear_notice_stocks(self):
         await self._notice_msg_repository.delete_all_notice_stocks()
 
     async def create_messages(self):
-        bulk_size = 10
-        bulk_data = []
-        count = 0
-        async for user_id, product_id, text_msg in self._messages_for_create_iter():
-            if count == bulk_size:
-                await self._notice_msg_repository.create_notice_msgs(bulk_data)
-                bulk_data.clear()
-                count = 0
-            bulk_data.append({'user_id': user_id, 'product_id': product_id, 'text': text_msg})
-            count += 1
-        if bulk_data:
-            await self._notice_msg_repository.create_notice_msgs(bulk_data)
-
-    async def _messages_for_create_iter(self):
-        async for notice_product_item in self._notice_msg_repository.get_notice_product_iter():
-            context = self._get_context_msg(notice_product_item)
-            text_msg = self._get_text_msg(context)
-            yield notice_product_item.user_id, notice_product_item.product_id, text_msg
-
-    def _get_context_msg(self, notice_product_item):
+        """Сообщения по всем изменениям из notice_stock (одним запросом в БД, без текста)"""
+        await self._notice_msg_repository.create_notice_msgs_from_stocks()
+
+    def _get_context_msg(self, notice_data):
         """
+        notice_data - данные сообщения (notice_msg.data)
+
         Это надо переделать, слишком разные случаи!!!
         может сделать разные шаблоны для сообщений (в зависимости от того, есть типы у товара или нет)
         """
         context = {
-            'product_name': notice_product_item.product_name,
-            'product_url': notice_product_item.product_url,
-            'product_reference': notice_product_item.product_reference,
-            'shop_label': notice_product_item.shop_label,
+            'product_name': notice_data['product_name'],
+            'product_url': notice_data['product_url'],
+            'product_reference': notice_data['product_reference'],
+            'shop_label': notice_data['shop_label'],
             }
-        product_parameters = notice_product_item.product_parameters
+        product_parameters = notice_data['product_parameters']
         if product_parameters:
             types = self._get_product_types(product_parameters['types'])
             context['type_label'] = product_parameters.get('type_label')
             context['option_label'] = product_parameters.get('option_label')
             data_msg_d = {}
-            for data_item in notice_product_item.notice_data:
+            for data_item in notice_data['notice_data']:
                 change_data = data_item['data']
                 if 'price' in change_data:
                     self._edit_change_price_data(change_data['price'])
@@ -74,7 +95,7 @@ class NoticeMessageService:
             data_msg = data_msg_d.values()
         else:
             data_msg = []
-            for data_item in notice_product_item.notice_data:
+            for data_item in notice_data['notice_data']:
                 change_data = data_item['data']
                 if 'price' in change_data:
                     self._edit_change_price_data(change_data['price'])
@@ -94,6 +115,41 @@ class NoticeMessageService:
     def _get_text_msg(self, context):
         return jinja_render.render_template('notice_msg.html', context)
 
+    def _get_digest_msgs(self, rows, max_length):
+        """
+        Дайджест по сообщениям одного пользователя: [(msg_ids, text)]
+
+        блок каждого товара рендерится один раз, блоки добавляются в сообщение,
+        пока сумма их длин и длины заголовка не больше max_length,
+        блок, который не помещается и в пустое сообщение, делится по строкам
+        (строки шаблона не разрывают теги), его msg_id попадает в каждую часть
+        """
+        # заголовок для наибольшего количества товаров - с запасом по числу цифр
+        wrapper_length = len(self._get_digest_text_msg([], len(rows)))
+        block_max_length = max_length - wrapper_length
+        blocks = []
+        for row in rows:
+            block = jinja_render.render_template(
+                'notice_digest_item_msg.html', {'notice': self._get_context_msg(row.data)})
+            blocks.extend((row.id, part) for part in _split_lines(block, block_max_length))
+
+        digest_msgs = []
+        msg_ids, msg_blocks, length = [], [], wrapper_length
+        for msg_id, block in blocks:
+            if msg_blocks and length + len(block) > max_length:
+                digest_msgs.append((msg_ids, self._get_digest_text_msg(msg_blocks, len(msg_ids))))
+                msg_ids, msg_blocks, length = [], [], wrapper_length
+            if msg_id not in msg_ids:
+                msg_ids.append(msg_id)
+            msg_blocks.append(block)
+            length += len(block)
+        if msg_blocks:
+            digest_msgs.append((msg_ids, self._get_digest_text_msg(msg_blocks, len(msg_ids))))
+        return digest_msgs
+
+    def _get_digest_text_msg(self, blocks, count):
+        return jinja_render.render_template('notice_digest_msg.html', {'blocks': blocks, 'count': count})
+
     def _get_product_types(self, types):
         types_d = {}
         for item in types:
@@ -116,3 +172,20 @@ class NoticeMessageService:
                 else:
                     diff_val = int(diff_val)
             change_price_data[key] = {'old': old_val, 'new': new_val, 'diff': diff_val}
+
+
+def _split_lines(text, max_length):
+    """Деление текста по строкам на части не длиннее max_length (слишком длинная строка обрезается)"""
+    if len(text) <= max_length:
+        return [text]
+    parts = []
+    part = ''
+    for line in text.splitlines(keepends=True):
+        line = line[:max_length]
+        if part and len(part) + len(line) > max_length:
+            parts.append(part)
+            part = ''
+        part += line
+    if part:
+        parts.append(part)
+    return parts
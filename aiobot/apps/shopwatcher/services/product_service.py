@@ -1,4 +1,8 @@
 
+import attr
+import hashlib
+import json
+
 from typing import (
     List, Optional, Mapping, Tuple
 )
@@ -6,7 +10,6 @@ from typing import (
 from marshmallow import ValidationError
 
 # from utils.timezone import now
-from core.exceptions import ObjectDoesNotExist
 
 from .exceptions import DeserializeProductError
 from ..serializers import product_schema
@@ -19,37 +22,164 @@ class ProductService:
     templ_msg_delete_admin = ("Удаление строки из таблицы %s - id %d\n%s")
     templ_msg_not_available_admin = ("Установка not available для строки из таблицы %s - id %d\n%s")
 
-    def __init__(self, product_repository, notice_repository) -> None:
+    def __init__(self, product_repository) -> None:
         self._product_repository = product_repository
-        self._notice_repository = notice_repository
+        # {(shop_id, reference): (product_id, fingerprint)}, None - не загружены
+        self._fingerprints = None
+
+    async def load_fingerprints(self):
+        """Загрузка fingerprint товаров из БД (перед парсингом по расписанию)"""
+        self._fingerprints = await self._product_repository.get_product_fingerprints()
 
     async def handle(
         self,
         product_data: dict,
         shop_id: int,
         parent_product: Optional[Product] = None,
-        delete_not_exists_stock: bool = True
+        delete_not_exists_stock: bool = True,
+        skip_unchanged: bool = False
     ) -> None:
-        """Обработка данных полученных после парсинга страницы товара."""
-        if delete_not_exists_stock is None:
-            delete_not_exists_stock = True
-
-        msg_admins = None
-        try:
-            product_new = self._generate_product_from_data(product_data, shop_id, parent_product)
-        except DeserializeProductError as e:
-            raise e
+        """Обработка данных полученных после парсинга страницы товара (см. handle_batch)."""
+        entry = {
+            'product_data': product_data, 'shop_id': shop_id,
+            'parent_product': parent_product, 'delete_not_exists_stock': delete_not_exists_stock
+            }
+        results, errors = await self.handle_batch([entry], skip_unchanged=skip_unchanged)
+        if errors:
+            raise errors[0]
+        return results[0]
+
+    async def handle_batch(self, entries: List[dict], skip_unchanged: bool = False):
+        """Обработка результатов парсинга нескольких товаров:
+        текущие данные всех товаров читаются одним обращением к БД,
+        все изменения сохраняются в той же транзакции (ProductRepository.begin)
+
+        entries - словари с ключами product_data, shop_id, delete_not_exists_stock
+            и родителем: parent_product (Product) или parent_num - номер родителя в entries
+            (родитель должен идти раньше дочерних товаров)
+        skip_unchanged - если результат парсинга совпадает с сохраненным в прошлый раз
+            (по fingerprint), то товар не проверяется и не читается из БД,
+            возвращается Product без stocks только с данными из product_data и id
+
+        Возвращает (results, errors):
+            results[i] - (product, msg_admins) или None, если товар не обработан
+            errors - {i: DeserializeProductError}, дочерние товары при ошибке родителя пропускаются
+        """
+        results = [None] * len(entries)
+        errors = {}
+        products = {}
+        parents = {}
+        fingerprints = {}
+        # одинаковые товары в пачке (один список товаров с разных страниц) обрабатываются один раз
+        products_by_key = {}
+        delete_not_exists_stocks = {}
+        nums_handle = []
+        for num, entry in enumerate(entries):
+            parent = entry.get('parent_product')
+            if entry.get('parent_num') is not None:
+                parent = products.get(entry['parent_num'])
+                if parent is None:
+                    continue
+            parents[num] = parent
+            parent_id = parent.id if parent else None
+            delete_not_exists_stock = entry.get('delete_not_exists_stock')
+            if delete_not_exists_stock is None:
+                delete_not_exists_stock = True
+            delete_not_exists_stocks[num] = delete_not_exists_stock
+
+            # у родителя из этой же пачки еще нет id - fingerprint посчитается после чтения из БД
+            fingerprint = None
+            if parent is None or parent_id is not None:
+                fingerprint = get_product_fingerprint(
+                    entry['product_data'], entry['shop_id'], parent_id, delete_not_exists_stock)
+                if skip_unchanged:
+                    product_unchanged = self._get_unchanged_product(
+                        entry['product_data'], entry['shop_id'], parent_id, fingerprint)
+                    if product_unchanged is not None:
+                        products[num] = product_unchanged
+                        results[num] = (product_unchanged, None)
+                        continue
+            fingerprints[num] = fingerprint
+
+            try:
+                product_new = self._generate_product_from_data(
+                    entry['product_data'], entry['shop_id'], parent)
+            except DeserializeProductError as e:
+                errors[num] = e
+                continue
+            key = (product_new.shop_id, product_new.reference)
+            if key in products_by_key:
+                products[num] = products_by_key[key]
+                continue
+            product_new.fingerprint = fingerprint
+            products[num] = products_by_key[key] = product_new
+            nums_handle.append(num)
+
+        if not nums_handle:
+            return results, errors
+
+        # чтение и сохранение - одна коннекция из пула и одна транзакция
+        async with self._product_repository.begin():
+            products_cur = await self._product_repository.get_products_by_references(products_by_key.keys())
+            changes = {
+                'products_create': [], 'products_update': [],
+                'stocks_create': [], 'stocks_update': [],
+                'stocks_delete_ids': [], 'stocks_unavailable_ids': [],
+                'price_history_stocks': [], 'notice_data': {},
+                }
+            msg_admins = {}
+            for num in nums_handle:
+                product_new = products[num]
+                parent = parents[num]
+                # id родителя из этой же пачки известен только после чтения из БД
+                if parent is not None and parent.id is not None and product_new.parent_id is None:
+                    product_new.parent_id = parent.id
+                    product_new.fingerprint = get_product_fingerprint(
+                        entries[num]['product_data'], product_new.shop_id,
+                        parent.id, delete_not_exists_stocks[num]
+                        )
+                product_cur = products_cur.get((product_new.shop_id, product_new.reference))
+                if product_cur is None:
+                    changes['products_create'].append((product_new, parent))
+                    continue
+                product_new.id = product_cur.id
+                msg_admin_rows = []
+                update_product_data = self._check_product(product_new, product_cur, msg_admin_rows)
+                if update_product_data or product_new.fingerprint != product_cur.fingerprint:
+                    changes['products_update'].append((product_new, parent))
+                self._check_product_stocks(
+                    product_new, product_cur, msg_admin_rows,
+                    delete_not_exists_stocks[num], changes
+                    )
+                msg_admins[num] = await self._get_msg_admins(msg_admin_rows)
+
+            await self._product_repository.save_products(**changes)
+
+        for num, product_obj in products.items():
+            if results[num] is None:
+                results[num] = (product_obj, msg_admins.get(num))
+                self._remember_fingerprint(product_obj)
+        return results, errors
+
+    def _get_unchanged_product(self, product_data, shop_id, parent_id, fingerprint):
+        reference = product_data.get('reference')
+        if self._fingerprints is None or reference is None:
+            return
+        product_fingerprint = self._fingerprints.get((shop_id, reference))
+        if product_fingerprint is None or product_fingerprint[1] != fingerprint:
+            return
+        return Product(
+            name=product_data.get('name'), reference=reference,
+            url=product_data.get('url'), url_parse=product_data.get('url_parse'),
+            parameters=product_data.get('parameters'), shop_id=shop_id,
+            parent_id=parent_id, id=product_fingerprint[0], fingerprint=fingerprint
+            )
 
-        try:
-            product_cur = await self._get_product_from_repository(product_new.reference, shop_id)
-            product_new.id = product_cur.id
-            msg_admin_rows, notice_struct = await self._update_product_and_stocks(
-                product_new, product_cur, delete_not_exists_stock)
-            await self._save_notice(notice_struct)
-            msg_admins = await self._get_msg_admins(msg_admin_rows)
-        except ObjectDoesNotExist:
-            product_new.id = await self._create_product_and_stocks(product_new)
-        return product_new, msg_admins
+    def _remember_fingerprint(self, product_obj):
+        if (self._fingerprints is not None and product_obj.reference is not None
+                and product_obj.fingerprint is not None):
+            self._fingerprints[(product_obj.shop_id, product_obj.reference)] = \
+                (product_obj.id, product_obj.fingerprint)
 
     def _generate_product_from_data(self, product_data, shop_id, parent_product):
         product_clean_data = self._deserialize_data(product_data)
@@ -64,30 +194,6 @@ class ProductService:
         except ValidationError as err:
             raise DeserializeProductError('Ошибка валидации', errors=err.messages)
 
-    async def _get_product_from_repository(self, reference, shop_id):
-        return await self._product_repository.get_product_by_reference(
-            reference, shop_id)
-
-    async def _create_product_and_stocks(self, product_new):
-        return await self._product_repository.create_product_and_stocks(product_new)
-
-    async def _update_product_and_stocks(self, product_new, product_cur, delete_not_exists_stock):
-        msg_admin_rows = []
-        update_product_data = self._check_product(product_new, product_cur, msg_admin_rows)
-        stocks_create, stocks_update_data, stocks_delete_ids, notice_struct = \
-            await self._check_product_stocks(
-                product_new, product_cur, msg_admin_rows, delete_not_exists_stock)
-
-        await self._product_repository.update_product_and_stocks(
-            product_cur.id,
-            update_product_data,
-            stocks_create,
-            stocks_update_data,
-            stocks_delete_ids,
-            delete_not_exists_stock
-            )
-        return msg_admin_rows, notice_struct
-
     def _check_product(self, product_new, product_cur, msg_admin_rows):
         """Проверяем актуальность данных для product
         """
@@ -102,44 +208,40 @@ class ProductService:
                 msg_admin_rows.append(msg_row)
         return update_product_data
 
-    async def _check_product_stocks(
-        self, product_new, product_cur, msg_admin_rows, delete_not_exists_stock
+    def _check_product_stocks(
+        self, product_new, product_cur, msg_admin_rows, delete_not_exists_stock, changes
     ):
-        notice_data = {}
-        available_stock_ids = set()
+        """Сравнение stocks товара, изменения добавляются в changes (см. handle_batch)"""
+        notice_data = changes['notice_data']
         # делаем словарь на основе списка, чтобы при сравнении быстро доставать данные
         stocks_new = {item.sku: item for item in product_new.stocks}
-        stocks_update_data = {}
-        stocks_delete_ids = []
 
         for stock_cur in product_cur.stocks:
             stock_new = stocks_new.get(stock_cur.sku)
             if stock_new is not None:
                 update_data, price_change, became_available = \
-                    await self._check_stock(stock_cur, stock_new, msg_admin_rows)
+                    self._check_stock(stock_cur, stock_new, msg_admin_rows)
                 if update_data:
-                    stocks_update_data[stock_cur.id] = update_data
+                    changes['stocks_update'].append(attr.evolve(stock_cur, **update_data))
+                if price_change:
+                    changes['price_history_stocks'].append(stock_cur)
 
                 self._set_notice_data_stock(stock_cur.id, price_change, became_available, notice_data)
-                if stock_new.available:
-                    available_stock_ids.add(stock_cur.id)
                 # удаляем, чтобы после цикла остались только новые данные, которые надо сохранить
                 del stocks_new[stock_cur.sku]
             else:
                 stock_id = self._check_delete_stock(
                     product_cur.id, stock_cur, msg_admin_rows, delete_not_exists_stock)
                 if stock_id:
-                    stocks_delete_ids.append(stock_id)
+                    if delete_not_exists_stock:
+                        changes['stocks_delete_ids'].append(stock_id)
+                    else:
+                        changes['stocks_unavailable_ids'].append(stock_id)
 
-        if notice_data:
-            notice_struct = {'data': notice_data, 'available_stock_ids': available_stock_ids}
-        else:
-            notice_struct = None
-
-        # if stocks_new:  # если остались данные, то это новые, которых нет в БД
-        return list(stocks_new.values()), stocks_update_data, stocks_delete_ids, notice_struct
+        # если остались данные, то это новые, которых нет в БД
+        changes['stocks_create'].extend((product_cur.id, stock) for stock in stocks_new.values())
 
-    async def _check_stock(self, stock_cur, stock_new, msg_admin_rows):
+    def _check_stock(self, stock_cur, stock_new, msg_admin_rows):
         update_data = {}
         stock_id = stock_cur.id
 
@@ -152,9 +254,6 @@ class ProductService:
         became_available = self._check_available_stock(
             stock_id, stock_cur.available, stock_new.available, update_data
             )
-        if price_change:
-            await self._product_repository.create_price_history(stock_cur)
-
         return update_data, price_change, became_available
 
     def _set_notice_data_stock(self, stock_id, price_change, became_available, notice_data):
@@ -231,64 +330,6 @@ class ProductService:
             msg_row = self.templ_msg_change_admin % ('product_stock', stock_id, 'parameters', val_old, val_new)
             msg_admin_rows.append(msg_row)
 
-    async def _save_notice(self, notice_struct):
-        """
-        """
-        if not notice_struct:
-            return
-
-        notice_data = notice_struct['data']
-        available_stock_ids = notice_struct['available_stock_ids']
-
-        stock_ids = notice_data.keys()
-        notice_stocks_bd = await self._notice_repository.get_notice_stocks(stock_ids)
-
-        if not notice_stocks_bd:
-            await self._notice_repository.save_notice_stocks(notice_data)
-        else:
-            # сравниваем данные из БД с актуальными
-            update_notice_data = {}
-            delete_notice_ids = []
-            for notice_stock_bd in notice_stocks_bd:
-                data_change = None
-                notice_stock_data_new = notice_data.get(notice_stock_bd.stock_id)
-                if notice_stock_data_new is not None:
-                    data_change = self._check_change_notice_stock(
-                        notice_stock_bd.data, notice_stock_data_new
-                        )
-                    if data_change:
-                        update_notice_data[notice_stock_bd.stock_id] = data_change
-                    del notice_data[notice_stock_bd.stock_id]
-                else:
-                    notice_stock_id = self._check_delete_notice_stock(
-                        notice_stock_bd, available_stock_ids)
-                    if notice_stock_id:
-                        delete_notice_ids.append(notice_stock_id)
-
-            await self._notice_repository.save_notice_stocks(
-                notice_data, update_notice_data, delete_notice_ids
-                )
-
-    def _check_change_notice_stock(self, notice_stock_data_bd, notice_stock_data_new):
-        """
-        Бывают случаи изменения разных цен base, sale
-        поэтому используем слияние словарей, чтобы осталось старое значение
-        причем если ключ одинаковый старое заменится новым
-        """
-        data_change = None
-        if (notice_stock_data_new != notice_stock_data_bd and 'price' in notice_stock_data_new):
-            if 'price' in notice_stock_data_bd:
-                data_change = {'price': {**notice_stock_data_bd['price'], **notice_stock_data_new['price']}}
-            else:
-                data_change = notice_stock_data_new
-
-        return data_change
-
-    def _check_delete_notice_stock(self, notice_stock_bd, available_stock_ids):
-        if ('available' in notice_stock_bd.data and
-                notice_stock_bd.stock_id not in available_stock_ids):
-            return notice_stock_bd.id
-
     async def _get_msg_admins(self, msg_admin_rows):
         if msg_admin_rows:
             msg_text = ''
@@ -297,6 +338,22 @@ class ProductService:
             return msg_text
 
 
+def get_product_fingerprint(product_data, shop_id, parent_id=None, delete_not_exists_stock=True):
+    """
+    Стабильный хэш результата парсинга товара:
+        ключи словарей отсортированы, stocks - по sku (порядок на странице может меняться),
+        учитываются также магазин, родительский товар и режим удаления stocks
+    """
+    data = dict(product_data)
+    if data.get('stocks'):
+        data['stocks'] = sorted(data['stocks'], key=lambda item: str(item.get('sku')))
+    data_str = json.dumps(
+        [data, shop_id, parent_id, bool(delete_not_exists_stock)],
+        sort_keys=True, ensure_ascii=False, separators=(',', ':'), default=str
+        )
+    return hashlib.sha1(data_str.encode('utf-8')).hexdigest()
+
+
 class ProductSubService:
     def __init__(self, product_sub_repository) -> None:
         self._product_sub_repository = product_sub_repository
@@ -305,8 +362,8 @@ class ProductSubService:
         product = await self._product_sub_repository.get_product_for_sub(sub_id, user_id)
         return product
 
-    async def get_product_parse_data(self):
-        rows = []
+    async def get_product_parse_data_iter(self):
+        """Параметры запросов для парсинга, читаются из БД по мере обработки очереди"""
         async for item in self._product_sub_repository.get_product_for_sub_iter():
             if not item.url_parse:
                 raise ValueError('url_parse must be set')
@@ -316,10 +373,23 @@ class ProductSubService:
                 }
             headers = None
             cookies = None
+            throttle = None
+            conditional = False
             parse_params = item.parse_params
             if parse_params:
                 headers = parse_params.get('headers')
                 cookies = parse_params.get('cookies')
+                # ограничения нагрузки на магазин при парсинге
+                throttle = {
+                    'limit': parse_params.get('host_limit'),
+                    'delay': parse_params.get('host_delay'),
+                    'max_limit': parse_params.get('host_max_limit'),
+                    }
+                # условные запросы (ETag / Last-Modified) только там, где все данные
+                # товара на одной странице, иначе пропустим изменения во втором запросе
+                conditional = bool(parse_params.get('conditional_get'))
                 kwargs_handler = {**kwargs_handler, **item.parse_params}
-            rows.append({'url': item.url_parse, 'headers': headers, 'cookies': cookies, 'kwargs': kwargs_handler})
-        return rows
+            yield {
+                'url': item.url_parse, 'headers': headers, 'cookies': cookies,
+                'throttle': throttle, 'conditional': conditional, 'kwargs': kwargs_handler
+                }
@@ -17,6 +17,10 @@ class UserService:
             await self._user_repository.create_user(user_obj)
         return user_obj
 
+    async def toggle_notice_digest(self, user_id):
+        """Включение / выключение оповещений дайджестом, возвращает новое значение"""
+        return await self._user_repository.toggle_notice_digest(user_id)
+
 
 class AdminService:
     def __init__(self, admin_repository):
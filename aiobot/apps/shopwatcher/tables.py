@@ -27,6 +27,8 @@ class StatusNoticeEnum(IntEnum):
     not_send = 0
     in_progress = 1
     sended = 2
+    # не отправлено за notice_outbox.max_attempts попыток
+    failed = 3
 
 
 user = Table(
@@ -34,6 +36,8 @@ user = Table(
     Column('id', Integer, primary_key=True),
     Column('user_id_orig', BigInteger, nullable=False, unique=True),
     Column('first_name', String(127), nullable=True),
+    # оповещения одним сообщением-дайджестом по всем товарам
+    Column('notice_digest', Boolean, nullable=False, default=False, server_default=false()),
     )
 
 group = Table(
@@ -78,14 +82,19 @@ product = Table(
     Column('url', String(1023), nullable=True),
     Column('url_parse', String(1023), nullable=True),
     Column('reference', String(127), nullable=True),
+    # отдельный индекс по shop_id не нужен - он первый в уникальном индексе
     Column('shop_id', Integer,
            ForeignKey('shop.id', ondelete='CASCADE'),
-           index=True, nullable=False),
+           nullable=False),
     Column('parent_id', Integer,
            ForeignKey('product.id', ondelete='CASCADE'),
            index=True, nullable=True),
     Column('dt_created', DateTime, default=now, nullable=False),
     Column('parameters', JSON, nullable=True),
+    # хэш результата парсинга, при котором товар последний раз сохранялся
+    Column('fingerprint', String(40), nullable=True),
+    # индексы и ограничения
+    UniqueConstraint('shop_id', 'reference'),
     )
 
 
@@ -170,9 +179,14 @@ notice_msg = Table(
     Column('product_id', Integer,
            ForeignKey('product.id', ondelete='SET NULL'),
            index=True, nullable=True),
-    Column('text', Text, nullable=False),
+    # текст формируется из data при отправке, если не задан
+    Column('text', Text, nullable=True),
+    # данные для шаблона сообщения (NoticeMessageRepository.create_notice_msgs_from_stocks)
+    Column('data', JSONB, nullable=True),
     Column('status', SmallInteger, nullable=False, default=StatusNoticeEnum.not_send.value),
     Column('dt_send', DateTime, nullable=True),
+    # количество неудачных попыток отправки
+    Column('retry_count', SmallInteger, nullable=False, default=0, server_default='0'),
 
     Index(None, 'dt_send',
           postgresql_where=(Column('dt_send').is_(None))
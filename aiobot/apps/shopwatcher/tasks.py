@@ -1,15 +1,25 @@
+import asyncio
 import traceback
 
-from utils.client_async import AdapterAioHttp
+from functools import partial
 
+from utils.client_async import AdapterAioHttp, ConnectionAioHttp, ValidatorCache, NOT_MODIFIED
+from utils.pipeline import Stage, Pipeline
+
+from settings.settings import config
 from settings.log import logger_service
 from apps.shopwatcher.url_handler import ProductDataHandler
-from apps.parser import get_parser, ParseError
+from apps.parser import get_parser, ParseError, RequestBatcher
+from db.statements import statement_cache
 
-from .management import send_msg_admins, send_msg_user
+from .management import send_msg_admins, MessageDelivery, join_messages, MESSAGE_MAX_LENGTH
 from .utils.decorators import log_except_for_admin
 from .cookies import set_actual_cookies
-from .services import product_sub_service, notice_msg_service
+from .services import product_service, product_sub_service, notice_msg_service, admin_service
+
+
+# ETag / Last-Modified страниц для магазинов с parse_params['conditional_get']
+validator_cache = ValidatorCache(**config.get('validator_cache', {}))
 
 
 @log_except_for_admin
@@ -17,13 +27,72 @@ async def parse_products_task():
     """
     Парсинг товаров по ссылкам
     Необходима доработка: ссылки для парсинга складывать в Redis!!!
+
+    Стадии связаны ограниченными очередями и имеют свои пулы обработчиков:
+        загрузка (AdapterAioHttp) -> парсинг -> сравнение с БД и сохранение
+    поэтому медленная запись в БД не останавливает загрузку страниц,
+    размеры пулов в config['crawl']
+
+    дополнительные запросы многоэтапных парсеров разных товаров одного магазина
+    объединяются, где api магазина это позволяет (RequestBatcher)
+
+    товары, результат парсинга которых не изменился с прошлого сохранения (fingerprint),
+    не сравниваются с БД, остальные сохраняются пачками до persist_batch_size страниц
+    (одно чтение и одна транзакция на пачку)
     """
-    adapter = AdapterAioHttp(
-        handler_response=handler_response,
-        handler_errors=handler_errors
-        )
-    list_url = await product_sub_service.get_product_parse_data()
-    result = await adapter.queue_request(list_url)
+    crawl_config = config.get('crawl', {})
+    queue_size = crawl_config.get('stage_queue_size', 50)
+    validator_cache.load()
+    await product_service.load_fingerprints()
+    # соединение для вторых запросов многоэтапных парсеров
+    async with ConnectionAioHttp() as connector:
+        batcher = RequestBatcher(
+            connector,
+            window=crawl_config.get('batch_window', 0.5),
+            max_size=crawl_config.get('batch_max_size', 20)
+            )
+        persist_stage = Stage(
+            'persist', persist_stage_handler,
+            count_workers=crawl_config.get('persist_workers', 2), queue_size=queue_size,
+            batch_size=crawl_config.get('persist_batch_size', 20),
+            batch_wait=crawl_config.get('persist_batch_wait', 1)
+            )
+        parse_stage = Stage(
+            'parse', partial(parse_stage_handler, connector=connector, batcher=batcher),
+            count_workers=crawl_config.get('parse_workers', 2), queue_size=queue_size,
+            next_stage=persist_stage
+            )
+        pipeline = Pipeline([parse_stage, persist_stage])
+
+        async def fetch_stage_handler(response, **kwargs):
+            # страница не изменилась с прошлого парсинга - нечего обрабатывать
+            if response is NOT_MODIFIED:
+                return
+            await parse_stage.put((response, kwargs))
+
+        adapter = AdapterAioHttp(
+            handler_response=fetch_stage_handler,
+            handler_errors=handler_errors,
+            per_host=True,
+            adaptive=True,
+            validator_cache=validator_cache,
+            spool_threshold=crawl_config.get('spool_threshold'),
+            overflow_size=crawl_config.get('overflow_size')
+            )
+        params_iter = product_sub_service.get_product_parse_data_iter()
+        pipeline.start()
+        try:
+            result = await adapter.queue_request(params_iter)
+            await pipeline.join()
+        finally:
+            await pipeline.stop()
+            await batcher.close()
+            validator_cache.save()
+
+    logger_service.info(f"Параметры загрузки по хостам: {adapter.get_hosts_stats()}")
+    logger_service.info(f"Стадии обработки: {pipeline.get_stats()}")
+    logger_service.info(f"Объединение дополнительных запросов: {batcher.get_stats()}")
+    logger_service.info(f"Кэш скомпилированных запросов к БД: {statement_cache.get_stats()}")
     if 'errors' in result:
         for error in result['errors']:
             msg_log = str(error)
@@ -38,10 +107,23 @@ async def handler_errors(error, **kwargs):
     return True
 
 
+async def parse_stage_handler(item, connector, batcher):
+    response, kwargs = item
+    kwargs['connector'] = connector
+    kwargs['batcher'] = batcher
+    parse_result = await handler_parse(response, **kwargs)
+    if parse_result is not None:
+        return parse_result, kwargs
+
+
+async def persist_stage_handler(items):
+    await handler_persist_batch(items)
+
+
 @log_except_for_admin
-async def handler_response(response, **kwargs):
+async def handler_parse(response, **kwargs):
     """
-    Обработка результата запроса по ссылке
+    Парсинг результата запроса по ссылке
     """
     url_parse = kwargs['url']
     try:
@@ -51,32 +133,91 @@ async def handler_response(response, **kwargs):
             url_parse=url_parse,
             url_product=kwargs.get('url_product'),
             connector=kwargs.get('connector'),
+            batcher=kwargs.get('batcher'),
             headers=kwargs.get('headers'),
             cookies=kwargs.get('cookies')
             )
     except ParseError as e:
+        validator_cache.discard(url_parse)
         tb = traceback.format_exc()
         msg_traceback = "....\nOriginal exception was:\n %s" % tb
         msg = f"Ошибка парсинга при обработке url {url_parse}, {str(e)}\n{msg_traceback}"
         await send_msg_admins(msg)
         return
+    return parse_result
 
-    product_data = parse_result.get('data')
-    await ProductDataHandler().handle(
-        product_data, kwargs['shop_id'], kwargs.get('delete_not_exists_stock')
-        )
+
+@log_except_for_admin
+async def handler_persist_batch(items):
+    """
+    Сравнение результатов парсинга пачки страниц с данными в БД и сохранение
+    items - список (parse_result, kwargs)
+    """
+    batch = [
+        (parse_result.get('data'), kwargs['shop_id'], kwargs.get('delete_not_exists_stock'))
+        for parse_result, kwargs in items
+        ]
+    try:
+        errors = await ProductDataHandler().handle_batch(batch, skip_unchanged=True)
+    except Exception:
+        # данные не сохранены - в следующий раз страницы надо получить полностью
+        for _, kwargs in items:
+            validator_cache.discard(kwargs['url'])
+        raise
+
+    for item_num, error in errors.items():
+        url = items[item_num][1]['url']
+        validator_cache.discard(url)
+        await send_msg_admins(f"Ошибка обработки товара {url}:\n{str(error)}")
 
 
 @log_except_for_admin
 async def send_notice_task():
     """Формирование и отправка оповещений пользователям."""
+    time_created = asyncio.get_running_loop().time()
     await notice_msg_service.create_messages()
     await notice_msg_service.clear_notice_stocks()
 
-    async for user_id, user_name, text in notice_msg_service.get_message_iter():
-        await send_msg_user(user_id, text)
-        msg_admin = f"Сообщение пользователю {user_name} ({user_id}):\n{text}"
-        await send_msg_admins(msg_admin, is_html_mode=True)
+    outbox_config = config.get('notice_outbox', {})
+    await notice_msg_service.release_stale_messages(outbox_config.get('claim_timeout', 3600))
+    results = {True: [], False: []}
+
+    async def finalize():
+        # результаты отправки сохраняются после каждой захваченной пачки
+        sent_ids, failed_ids = results[True], results[False]
+        results[True], results[False] = [], []
+        await notice_msg_service.finalize_messages(
+            sent_ids, failed_ids, outbox_config.get('max_attempts', 3))
+
+    admins_ids = await admin_service.get_admins_id_orig()
+    try:
+        async with MessageDelivery(**config.get('notice_delivery', {})) as delivery:
+            while True:
+                msgs = await notice_msg_service.claim_messages(
+                    outbox_config.get('claim_size', 100), outbox_config.get('retry_delay', 600),
+                    MESSAGE_MAX_LENGTH
+                    )
+                if not msgs:
+                    break
+                # сообщение-дайджест отмечает отправленными все вошедшие в него notice_msg
+                for msg_ids, user_id, user_name, text in msgs:
+                    await delivery.send(
+                        user_id, text, parse_mode='HTML', created=time_created,
+                        callback=lambda is_sent, msg_ids=msg_ids: results[is_sent].extend(msg_ids)
+                        )
+                # копии для администраторов по каждой пачке объединяются,
+                # чтобы не упираться в лимит сообщений в один чат
+                msgs_admin = [
+                    f"Сообщение пользователю {user_name} ({user_id}):\n{text}"
+                    for _, user_id, user_name, text in msgs
+                    ]
+                for msg_admin in join_messages(msgs_admin):
+                    for admin_id in admins_ids:
+                        await delivery.send(admin_id, msg_admin, parse_mode='HTML')
+                await finalize()
+    finally:
+        await finalize()
+    logger_service.info(f"Отправка оповещений: {delivery.get_stats()}")
 
 
 async def everyday_msg_admins_task():
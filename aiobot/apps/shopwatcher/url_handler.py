@@ -63,7 +63,7 @@ class UrlHandlerUser:
         """
         try:
             parser = get_parser(shop_name)
-            parse_result = await parser.get_response_and_parse(url, headers=headers, cookies=cookies)
+            parse_result = await parser.parse_url(url, headers=headers, cookies=cookies)
         except ParseError as e:
             tb = traceback.format_exc()
             msg_traceback = "....\nOriginal exception was:\n %s" % tb
@@ -76,19 +76,57 @@ class UrlHandlerUser:
 
 class ProductDataHandler:
     async def handle(
-        self, product_data, shop_id, delete_not_exists_stock, selected_type=None
+        self, product_data, shop_id, delete_not_exists_stock, selected_type=None,
+        skip_unchanged=False
     ):
+        """skip_unchanged - не обрабатывать товары, данные которых не изменились (см. ProductService)"""
         handler = get_handler_data(product_data)
         try:
             result = await handler(
                 product_data, shop_id,
                 selected_type=selected_type,
-                delete_not_exists_stock=delete_not_exists_stock
+                delete_not_exists_stock=delete_not_exists_stock,
+                skip_unchanged=skip_unchanged
                 )
         except HandleProductError as e:
             raise HandleMessageError(f"Ошибка обработки товара:\n{str(e)}")
         return result
 
+    async def handle_batch(self, items, skip_unchanged=False):
+        """
+        Обработка результатов парсинга нескольких страниц одной пачкой (ProductService.handle_batch)
+        items - список (product_data, shop_id, delete_not_exists_stock)
+        возвращает {номер элемента items: HandleMessageError} для необработанных страниц
+        """
+        entries = []
+        item_nums = []
+        for item_num, (product_data, shop_id, delete_not_exists_stock) in enumerate(items):
+            product_data_list = product_data if isinstance(product_data, list) else [product_data]
+            parent_num = None
+            for num, product_data_i in enumerate(product_data_list):
+                entries.append({
+                    'product_data': product_data_i, 'shop_id': shop_id,
+                    'delete_not_exists_stock': delete_not_exists_stock,
+                    # первый элемент списка - родитель остальных
+                    'parent_num': parent_num
+                    })
+                item_nums.append(item_num)
+                if num == 0:
+                    parent_num = len(entries) - 1
+
+        results, errors = await product_service.handle_batch(entries, skip_unchanged=skip_unchanged)
+        for num, result in enumerate(results):
+            if result is not None:
+                await _send_msg_admins_product(entries[num]['product_data'], result[1])
+
+        errors_items = {}
+        for num, e in errors.items():
+            msg_error = "Ошибка валидации"
+            if e.errors:
+                msg_error = f"Ошибки валидации:\n{errors_to_str(e.errors)}"
+            errors_items.setdefault(item_nums[num], HandleMessageError(msg_error))
+        return errors_items
+
 
 def get_handler_data(product_data):
     if isinstance(product_data, dict):
@@ -105,7 +143,8 @@ async def _handle_product_data_as_dict(
     """
     delete_not_exists_stock = kwargs.get('delete_not_exists_stock')
     product = await _handle_product(
-        product_data, shop_id, delete_not_exists_stock=delete_not_exists_stock
+        product_data, shop_id, delete_not_exists_stock=delete_not_exists_stock,
+        skip_unchanged=kwargs.get('skip_unchanged', False)
         )
     return product
 
@@ -115,25 +154,27 @@ async def _handle_product_data_as_list(
 ):
     selected_type = kwargs.get('selected_type')
     delete_not_exists_stock = kwargs.get('delete_not_exists_stock')
+    skip_unchanged = kwargs.get('skip_unchanged', False)
 
     if selected_type is not None:
         return await _handle_product_data_list_with_selected(
-            product_data, shop_id, selected_type, delete_not_exists_stock
+            product_data, shop_id, selected_type, delete_not_exists_stock, skip_unchanged
             )
     else:
         return await _handle_product_data_list_without_selected(
-            product_data, shop_id, delete_not_exists_stock
+            product_data, shop_id, delete_not_exists_stock, skip_unchanged
             )
 
 
 async def _handle_product_data_list_with_selected(
-    product_data, shop_id, selected_type, delete_not_exists_stock
+    product_data, shop_id, selected_type, delete_not_exists_stock, skip_unchanged=False
 ):
     product = None
     parent_product_data = product_data[0]
     parent_product = await _handle_product(
         parent_product_data, shop_id,
-        delete_not_exists_stock=delete_not_exists_stock
+        delete_not_exists_stock=delete_not_exists_stock,
+        skip_unchanged=skip_unchanged
         )
 
     if selected_type == parent_product.reference:
@@ -141,7 +182,7 @@ async def _handle_product_data_list_with_selected(
 
     for product_data_i in product_data[1:]:
         product_i = await _handle_product(
-            product_data_i, shop_id, parent_product, delete_not_exists_stock)
+            product_data_i, shop_id, parent_product, delete_not_exists_stock, skip_unchanged)
 
         if selected_type == product_i.reference:
             product = product_i
@@ -153,39 +194,46 @@ async def _handle_product_data_list_with_selected(
 
 
 async def _handle_product_data_list_without_selected(
-    product_data, shop_id, delete_not_exists_stock
+    product_data, shop_id, delete_not_exists_stock, skip_unchanged=False
 ):
     parent_product_data = product_data[0]
     parent_product = await _handle_product(
         parent_product_data, shop_id,
-        delete_not_exists_stock=delete_not_exists_stock
+        delete_not_exists_stock=delete_not_exists_stock,
+        skip_unchanged=skip_unchanged
         )
 
     for product_data_i in product_data[1:]:
         await _handle_product(
             product_data_i, shop_id,
             parent_product=parent_product,
-            delete_not_exists_stock=delete_not_exists_stock
+            delete_not_exists_stock=delete_not_exists_stock,
+            skip_unchanged=skip_unchanged
             )
     return parent_product
 
 
 async def _handle_product(
-    product_data, shop_id, parent_product=None, delete_not_exists_stock=False
+    product_data, shop_id, parent_product=None, delete_not_exists_stock=False, skip_unchanged=False
 ):
     try:
         product, msg_admins = await product_service.handle(
             product_data, shop_id=shop_id,
             parent_product=parent_product,
-            delete_not_exists_stock=delete_not_exists_stock
+            delete_not_exists_stock=delete_not_exists_stock,
+            skip_unchanged=skip_unchanged
             )
     except DeserializeProductError as e:
         if e.errors:
             msg_error = f"Ошибки валидации:\n{errors_to_str(e.errors)}"
             raise HandleMessageError(msg_error)
+    await _send_msg_admins_product(product_data, msg_admins)
+    return product
+
+
+async def _send_msg_admins_product(product_data, msg_admins):
     if msg_admins:
         url = product_data.get('url')
         if url:
             msg_admins = f"Обработка товара {url}\n{msg_admins}"
         await send_msg_admins(msg_admins)
-    return product
@@ -378,6 +378,20 @@ async def subscriptions_user(
         await message.message.edit_text(msg, reply_markup=keyboard, parse_mode='HTML', disable_web_page_preview=True)
 
 
+@log_except
+async def notice_digest(message: types.Message):
+    """Переключение оповещений одним сообщением (дайджестом) по всем товарам."""
+    user = await user_service.get_or_create_user(
+        message.from_user.id, message.from_user.first_name
+        )
+    is_digest = await user_service.toggle_notice_digest(user.id)
+    if is_digest:
+        msg = 'Изменения по всем подпискам будут приходить одним сообщением\nОтключить - /digest'
+    else:
+        msg = 'Изменения по каждому товару будут приходить отдельным сообщением\nВключить дайджест - /digest'
+    await message.answer(msg)
+
+
 @log_except
 async def manage_subscription(message: types.Message, regexp_command):
     """Изменение или удаление подписки."""
@@ -1,4 +1,3 @@
-from .aiopg.engine import DBEngine
-# from .asyncpg.engine import DBEngine
+from .engine import DBEngine
 
 db_engine = DBEngine()
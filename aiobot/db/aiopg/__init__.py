@@ -1,7 +1,8 @@
 from .engine import DBEngine
-from .utils import connection as connection_ctx, begin_transaction, _TransactionContextManager
+from .compiled import CompiledQuery
+from .utils import connection as connection_ctx, begin_transaction, unit_of_work, _TransactionContextManager
 
 __all__ = (
-    'DBEngine',
-    'connection_ctx', 'begin_transaction', '_TransactionContextManager',
+    'DBEngine', 'CompiledQuery',
+    'connection_ctx', 'begin_transaction', 'unit_of_work', '_TransactionContextManager',
     )
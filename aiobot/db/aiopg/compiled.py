@@ -0,0 +1,24 @@
+class CompiledQuery:
+    """
+    Запрос sqlalchemy, скомпилированный один раз для диалекта aiopg,
+    значения параметров обрабатываются при каждом выполнении так же, как в SAConnection.execute
+    (python default столбцов, json_serializer), а в psycopg2 передается готовый SQL-текст
+
+    типы результата не обрабатываются - psycopg2 сам возвращает json, numeric и даты как python объекты
+    """
+    def __init__(self, query, dialect):
+        self._compiled = query.compile(dialect=dialect)
+        self._processors = self._compiled._bind_processors
+        self.sql = self._compiled.string
+
+    def get_params(self, params=None):
+        compiled_params = self._compiled.construct_params(params)
+        processors = self._processors
+        return {
+            key: processors[key](value) if key in processors else value
+            for key, value in compiled_params.items()
+            }
+
+    def execute(self, db_connection, params=None):
+        # параметры передаются всегда, иначе psycopg2 не заменит %% на %
+        return db_connection.execute(self.sql, self.get_params(params))
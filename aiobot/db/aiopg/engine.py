@@ -1,9 +1,14 @@
+import itertools
+
 import aiopg.sa
 
 from aiopg.sa.engine import get_dialect
 
 from utils.json_serializer import json_dumps_extend
 from ..base_engine import BaseDBEngine
+from .compiled import CompiledQuery
+
+_cursor_counter = itertools.count()
 
 
 class DBEngine(BaseDBEngine):
@@ -22,3 +27,27 @@ class DBEngine(BaseDBEngine):
 
     def release(self, conn):
         return self._engine.release(conn)
+
+    def compile(self, query):
+        return CompiledQuery(query, self._engine.dialect)
+
+    async def stream(self, db_connection, query, fetch_size):
+        """
+        aiopg при async for получает весь результат сразу,
+        поэтому курсор объявляется на сервере (DECLARE) и читается по fetch_size строк (FETCH)
+        """
+        compiled = self.compile(query)
+        cursor_name = f'stream_{next(_cursor_counter)}'
+        # курсор без WITH HOLD живет только внутри транзакции
+        async with db_connection.begin():
+            await db_connection.execute(
+                f'DECLARE {cursor_name} NO SCROLL CURSOR FOR {compiled.sql}', compiled.get_params()
+                )
+            while True:
+                res = await db_connection.execute(f'FETCH FORWARD {int(fetch_size)} FROM {cursor_name}')
+                rows = await res.fetchall()
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+            await db_connection.execute(f'CLOSE {cursor_name}')
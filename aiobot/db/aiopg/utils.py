@@ -20,12 +20,19 @@ connection = ContextVar('connection', default=None)
 
 Применяется для выполнения действий в одной транзакции из сервиса
 после блокировки строки таблицы SELECT FOR UPDATE
-коннекция хранится в ContextVar
+коннекция хранится в ContextVar, ее же используют методы с db_connect_classmethod
 """
 
 
 @asynccontextmanager
 async def begin_transaction(db_engine):
+    current_connection = connection.get()
+    if current_connection is not None:
+        # внутри unit_of_work - вложенная транзакция на той же коннекции
+        async with current_connection.begin():
+            yield
+        return
+
     async with db_engine.acquire() as conn:
         async with conn.begin():
             conn_context = connection.set(conn)
@@ -35,6 +42,23 @@ async def begin_transaction(db_engine):
                 connection.reset(conn_context)
 
 
+@asynccontextmanager
+async def unit_of_work(db_engine):
+    """
+    Одна коннекция из пула и одна транзакция на весь обработчик:
+    методы репозиториев с db_connect_classmethod берут коннекцию из ContextVar,
+    вложенный unit_of_work ничего не открывает
+
+    внутри нельзя одновременно обращаться к БД из нескольких задач (asyncio.gather) -
+    они получат ту же коннекцию
+    """
+    if connection.get() is not None:
+        yield
+        return
+    async with begin_transaction(db_engine):
+        yield
+
+
 class _TransactionContextManager:
 
     def __init__(self, db_engine):
@@ -0,0 +1,6 @@
+from .engine import DBEngine
+from .connection import SAConnection, CompiledQuery, compile_query
+
+__all__ = (
+    'DBEngine', 'SAConnection', 'CompiledQuery', 'compile_query',
+    )
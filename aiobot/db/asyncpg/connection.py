@@ -0,0 +1,264 @@
+import datetime
+import re
+
+import asyncpg
+
+from sqlalchemy import text, DateTime, String
+from sqlalchemy.sql.elements import BindParameter
+from sqlalchemy.types import NullType
+from sqlalchemy.dialects.postgresql.psycopg2 import PGDialect_psycopg2, PGCompiler_psycopg2
+
+
+_param_re = re.compile(r'%%|%\((\w+)\)s')
+
+
+class APGCompiler(PGCompiler_psycopg2):
+    """
+    Как в aiopg: значения python-default столбцов (например dt_created=now) вычисляются при компиляции
+
+    asyncpg готовит запрос на сервере и тип каждого параметра должен определяться из запроса,
+    для строк в аргументах функций с типом any (json_build_object('data', ...)) и для значений
+    в CASE это не так, поэтому такие параметры явно приводятся к своему типу
+    """
+    def __init__(self, *args, **kwargs):
+        # параметры - значения THEN / ELSE
+        self._case_results = set()
+        super().__init__(*args, **kwargs)
+
+    def visit_function(self, func, **kw):
+        kw['within_function'] = True
+        return super().visit_function(func, **kw)
+
+    def visit_case(self, clause, **kw):
+        results = [result for _, result in clause.whens] + [clause.else_]
+        self._case_results.update(
+            result for result in results
+            if isinstance(result, BindParameter) and not isinstance(result.type, NullType)
+            )
+        return super().visit_case(clause, **kw)
+
+    def visit_bindparam(self, bindparam, within_function=False, **kw):
+        sql = super().visit_bindparam(bindparam, **kw)
+        if within_function and isinstance(bindparam.type, String) and isinstance(bindparam.value, str):
+            return f'CAST({sql} AS TEXT)'
+        if bindparam in self._case_results:
+            return f'CAST({sql} AS {self.dialect.type_compiler.process(bindparam.type)})'
+        return sql
+
+    def construct_params(self, *args, **kwargs):
+        params = super().construct_params(*args, **kwargs)
+        for column in self.prefetch:
+            params[column.key] = self._exec_default(column.default)
+        return params
+
+    def _exec_default(self, default):
+        if default.is_callable:
+            return default.arg(self.dialect)
+        return default.arg
+
+
+def get_dialect():
+    """
+    Диалект psycopg2 используется только для компиляции запросов в текст,
+    значения параметров и результатов преобразует сам asyncpg (json - кодеками соединения),
+    поэтому bind / result processors sqlalchemy не применяются
+    """
+    dialect = PGDialect_psycopg2()
+    dialect.statement_compiler = APGCompiler
+    dialect.implicit_returning = True
+    dialect.supports_native_enum = True
+    dialect._backslash_escapes = False
+    return dialect
+
+
+_dialect = get_dialect()
+
+
+class CompiledQuery:
+    """
+    SQL-текст с параметрами $1, $2 ... для asyncpg, значения подставляются при каждом выполнении,
+    одинаковый запрос дает одинаковый текст - asyncpg переиспользует prepared statement соединения
+    """
+    def __init__(self, query):
+        if isinstance(query, str):
+            query = text(query)
+        self._compiled = query.compile(dialect=_dialect)
+        positions = {}
+
+        def replace(match):
+            name = match.group(1)
+            if name is None:
+                return '%'
+            if name not in positions:
+                positions[name] = len(positions) + 1
+            return f'${positions[name]}'
+
+        self.sql = _param_re.sub(replace, self._compiled.string)
+        self._names = list(positions)
+
+    def get_args(self, params=None):
+        compiled_params = self._compiled.construct_params(params)
+        binds = self._compiled.binds
+        return [_prepare_value(compiled_params[name], binds[name].type) for name in self._names]
+
+    def execute(self, db_connection, params=None):
+        return db_connection.execute(self, params)
+
+
+def compile_query(query):
+    if isinstance(query, CompiledQuery):
+        return query
+    return CompiledQuery(query)
+
+
+def _prepare_value(value, type_):
+    """
+    Для timestamp without time zone postgres отбрасывает смещение из текста, который передает psycopg2,
+    asyncpg же aware datetime для такого столбца не принимает - отбрасываем tzinfo сами
+    """
+    if (isinstance(value, datetime.datetime) and value.tzinfo is not None
+            and isinstance(type_, DateTime) and not type_.timezone):
+        return value.replace(tzinfo=None)
+    return value
+
+
+class Row(asyncpg.Record):
+    """Запись asyncpg с доступом к полям через атрибуты (как RowProxy aiopg)"""
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class ResultProxy:
+    """Результат запроса в интерфейсе aiopg: строки уже получены (бинарный протокол asyncpg)"""
+    def __init__(self, rows):
+        self._rows = rows
+        self._position = 0
+
+    @property
+    def rowcount(self):
+        return len(self._rows)
+
+    async def fetchall(self):
+        rows = self._rows[self._position:]
+        self._position = len(self._rows)
+        return rows
+
+    async def fetchmany(self, size):
+        rows = self._rows[self._position:self._position + size]
+        self._position += len(rows)
+        return rows
+
+    async def fetchone(self):
+        if self._position >= len(self._rows):
+            return None
+        row = self._rows[self._position]
+        self._position += 1
+        return row
+
+    async def first(self):
+        return self._rows[0] if self._rows else None
+
+    async def scalar(self):
+        row = await self.first()
+        return row[0] if row is not None else None
+
+
+class _ExecuteContext:
+    """
+    await connection.execute(query) - ResultProxy со всеми строками,
+    async for row in connection.execute(query) - чтение курсором по мере обработки
+    (fetch_size - сколько строк курсор получает с сервера за раз)
+    """
+    def __init__(self, connection, query, params, fetch_size=None):
+        self._connection = connection
+        self._query = query
+        self._params = params
+        self._cursor_params = {'record_class': Row}
+        if fetch_size:
+            self._cursor_params['prefetch'] = fetch_size
+
+    def __await__(self):
+        return self._execute().__await__()
+
+    async def _execute(self):
+        compiled = compile_query(self._query)
+        rows = await self._connection.fetch(compiled.sql, *compiled.get_args(self._params), record_class=Row)
+        return ResultProxy(rows)
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        compiled = compile_query(self._query)
+        sql, args = compiled.sql, compiled.get_args(self._params)
+        # курсоры asyncpg работают только внутри транзакции
+        if self._connection.is_in_transaction():
+            async for row in self._connection.cursor(sql, *args, **self._cursor_params):
+                yield row
+        else:
+            async with self._connection.transaction():
+                async for row in self._connection.cursor(sql, *args, **self._cursor_params):
+                    yield row
+
+
+class Transaction:
+    """Транзакция в интерфейсе aiopg: async with connection.begin() или await connection.begin()"""
+    def __init__(self, connection):
+        self._transaction = connection.transaction()
+        self.is_active = False
+
+    def __await__(self):
+        return self._start().__await__()
+
+    async def _start(self):
+        await self._transaction.start()
+        self.is_active = True
+        return self
+
+    async def commit(self):
+        self.is_active = False
+        await self._transaction.commit()
+
+    async def rollback(self):
+        self.is_active = False
+        await self._transaction.rollback()
+
+    async def __aenter__(self):
+        return await self._start()
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if not self.is_active:
+            return
+        if exc_type is None:
+            await self.commit()
+        else:
+            await self.rollback()
+
+
+class SAConnection:
+    """Соединение asyncpg с интерфейсом aiopg.sa.SAConnection, который используют репозитории"""
+    def __init__(self, connection):
+        self.connection = connection
+
+    def execute(self, query, params=None, **kwargs):
+        if kwargs:
+            params = {**(params or {}), **kwargs}
+        return _ExecuteContext(self.connection, query, params)
+
+    def stream(self, query, params=None, fetch_size=None):
+        """async for row in connection.stream(query, fetch_size=500) - курсор на сервере"""
+        return _ExecuteContext(self.connection, query, params, fetch_size=fetch_size)
+
+    async def scalar(self, query, params=None, **kwargs):
+        res = await self.execute(query, params, **kwargs)
+        return await res.scalar()
+
+    def begin(self):
+        return Transaction(self.connection)
+
+    @property
+    def in_transaction(self):
+        return self.connection.is_in_transaction()
@@ -1,11 +1,87 @@
+import json
+
 import asyncpg
 
+from utils.json_serializer import json_dumps_extend
 from ..base_engine import BaseDBEngine
+from .connection import SAConnection, CompiledQuery
 
 
 class DBEngine(BaseDBEngine):
 
     async def get_new_engine(self, conn_params):
-        return await asyncpg.create_pool(
-            **conn_params,
+        return await Engine.create(conn_params)
+
+    def acquire(self):
+        """Обертки, чтобы выполнять методы без обращения к атрибуту engine"""
+        return self._engine.acquire()
+
+    def release(self, conn):
+        return self._engine.release(conn)
+
+    def compile(self, query):
+        return CompiledQuery(query)
+
+    def stream(self, db_connection, query, fetch_size):
+        return db_connection.stream(query, fetch_size=fetch_size).__aiter__()
+
+
+class Engine:
+    """
+    Пул соединений asyncpg с интерфейсом aiopg.sa.Engine (acquire, release, close, wait_closed)
+    параметры те же, что и для aiopg (config['postgres_db'])
+    """
+    def __init__(self, pool):
+        self._pool = pool
+
+    @classmethod
+    async def create(cls, conn_params):
+        conn_params = dict(conn_params)
+        conn_params.pop('echo', None)
+        if 'minsize' in conn_params:
+            conn_params['min_size'] = conn_params.pop('minsize')
+        if 'maxsize' in conn_params:
+            conn_params['max_size'] = conn_params.pop('maxsize')
+        pool = await asyncpg.create_pool(**conn_params, init=_init_connection)
+        return cls(pool)
+
+    def acquire(self):
+        return _AcquireContext(self._pool)
+
+    async def release(self, conn):
+        await self._pool.release(conn.connection)
+
+    def close(self):
+        self._closing = self._pool.close()
+
+    async def wait_closed(self):
+        await self._closing
+
+
+class _AcquireContext:
+    """async with engine.acquire() as conn или conn = await engine.acquire()"""
+    def __init__(self, pool):
+        self._pool = pool
+        self._conn = None
+
+    def __await__(self):
+        return self._acquire().__await__()
+
+    async def _acquire(self):
+        return SAConnection(await self._pool.acquire())
+
+    async def __aenter__(self):
+        self._conn = await self._acquire()
+        return self._conn
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self._pool.release(self._conn.connection)
+        self._conn = None
+
+
+async def _init_connection(connection):
+    # json / jsonb как в aiopg: словари и списки python
+    for type_name in ('json', 'jsonb'):
+        await connection.set_type_codec(
+            type_name, encoder=json_dumps_extend, decoder=json.loads, schema='pg_catalog'
             )
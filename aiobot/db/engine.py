@@ -0,0 +1,74 @@
+from contextlib import asynccontextmanager
+
+
+class DBEngine:
+    """
+    Драйвер БД выбирается при создании по параметру backend из config['postgres_db']:
+        aiopg (по умолчанию) или asyncpg, репозитории работают с обоими одинаково
+    """
+    backends = ('aiopg', 'asyncpg')
+
+    def __init__(self):
+        self._backend = None
+        self._backend_name = None
+        self.stream_fetch_size = 1000
+
+    @property
+    def engine(self):
+        if self._backend is None:
+            raise ValueError('Call create method before get engine attr')
+        return self._backend.engine
+
+    @property
+    def backend_name(self):
+        return self._backend_name
+
+    async def create(self, conn_params):
+        conn_params = dict(conn_params)
+        backend_name = conn_params.pop('backend', None) or 'aiopg'
+        self.stream_fetch_size = conn_params.pop('stream_fetch_size', None) or self.stream_fetch_size
+        if backend_name == 'aiopg':
+            from .aiopg.engine import DBEngine as BackendEngine
+        elif backend_name == 'asyncpg':
+            from .asyncpg.engine import DBEngine as BackendEngine
+        else:
+            raise ValueError(f'Unknown db backend {backend_name}, expected one of {self.backends}')
+        self._backend_name = backend_name
+        self._backend = BackendEngine()
+        await self._backend.create(conn_params)
+
+    def acquire(self):
+        return self.engine.acquire()
+
+    def release(self, conn):
+        return self.engine.release(conn)
+
+    def compile(self, query):
+        """Запрос, скомпилированный для драйвера: compiled.execute(db_connection, params)"""
+        if self._backend is None:
+            raise ValueError('Call create method before compile query')
+        return self._backend.compile(query)
+
+    @asynccontextmanager
+    async def stream(self, db_connection, query, fetch_size=None):
+        """
+        Строки читаются курсором на сервере порциями по fetch_size
+        (по умолчанию stream_fetch_size из config['postgres_db']),
+        в памяти не больше одной порции, на время чтения открыта транзакция:
+            async with db_engine.stream(db_connection, query) as rows:
+                async for row in rows:
+                    ...
+        при выходе из блока курсор закрывается сразу, до возврата коннекции в пул
+
+        коннекция и снимок транзакции держатся, пока читаются строки, поэтому для медленного
+        обхода (очередь парсинга) лучше порции по id на короткой коннекции
+        """
+        rows = self._backend.stream(db_connection, query, fetch_size or self.stream_fetch_size)
+        try:
+            yield rows
+        finally:
+            await rows.aclose()
+
+    async def close(self):
+        if self._backend is not None:
+            await self._backend.close()
@@ -0,0 +1,49 @@
+from . import db_engine
+
+
+class StatementCache:
+    """
+    Скомпилированные запросы Statement для текущего драйвера БД,
+    hits / misses показывают, сколько выполнений обошлось без компиляции
+    """
+    def __init__(self, engine):
+        self._engine = engine
+        self._compiled = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, statement):
+        key = (self._engine.backend_name, statement)
+        compiled = self._compiled.get(key)
+        if compiled is None:
+            self.misses += 1
+            compiled = self._engine.compile(statement.query)
+            self._compiled[key] = compiled
+        else:
+            self.hits += 1
+        return compiled
+
+    def clear(self):
+        self._compiled.clear()
+
+    def get_stats(self):
+        return {'statements': len(self._compiled), 'hits': self.hits, 'misses': self.misses}
+
+
+statement_cache = StatementCache(db_engine)
+
+
+class Statement:
+    """
+    Запрос с параметрами sa.bindparam, который объявляется один раз (атрибутом репозитория)
+    и компилируется в SQL-текст при первом выполнении, дальше выполняется со значениями параметров:
+        _get_user = Statement(sa.select((user.c.id, )).where(user.c.id == sa.bindparam('user_id')))
+        res = await self._get_user.execute(db_connection, user_id=user_id)
+
+    структура запроса не должна зависеть от значений: вместо in_(список) - == sa.any_(bindparam)
+    """
+    def __init__(self, query):
+        self.query = query
+
+    def execute(self, db_connection, **params):
+        return statement_cache.get(self).execute(db_connection, params)
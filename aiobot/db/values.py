@@ -0,0 +1,49 @@
+import sqlalchemy as sa
+
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FromClause
+
+
+class Values(FromClause):
+    """
+    (VALUES (...), (...)) AS name (column, ...) - в sqlalchemy 1.3 своей конструкции нет
+
+    columns - список sa.column(name, type), rows - список кортежей значений в том же порядке
+    используется для UPDATE ... FROM одним запросом вместо запроса на каждую строку:
+        v = Values([sa.column('id', Integer), sa.column('price', Numeric)], rows, 'v')
+        table.update().values(price=v.c.price).where(table.c.id == v.c.id)
+    """
+    named_with_column = True
+
+    def __init__(self, columns, rows, name):
+        self._values_columns = columns
+        self.rows = rows
+        self.name = name
+
+    def _populate_column_collection(self):
+        for column in self._values_columns:
+            column._make_proxy(self)
+
+    @property
+    def _from_objects(self):
+        return [self]
+
+
+@compiles(Values)
+def _compile_values(element, compiler, asfrom=False, **kw):
+    rows_sql = []
+    for num, row in enumerate(element.rows):
+        values_sql = []
+        for column, value in zip(element._values_columns, row):
+            param = sa.bindparam(None, value, type_=column.type)
+            # типы столбцов VALUES postgres определяет по первой строке (иначе NULL будет text)
+            if num == 0:
+                param = sa.cast(param, column.type)
+            values_sql.append(compiler.process(param, **kw))
+        rows_sql.append(f"({', '.join(values_sql)})")
+
+    sql = f"VALUES {', '.join(rows_sql)}"
+    if asfrom:
+        columns_sql = ', '.join(compiler.preparer.quote(column.name) for column in element._values_columns)
+        sql = f"({sql}) AS {compiler.preparer.quote(element.name)} ({columns_sql})"
+    return sql
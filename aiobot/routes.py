@@ -26,6 +26,7 @@ def setup_routes(dp):
     dp.register_message_handler(views.commands, commands=['start'], state="*")
     dp.register_message_handler(views.supported_shops, commands=['shops'], state="*")
     dp.register_message_handler(views.subscriptions_user, commands=['subs'], state="*")
+    dp.register_message_handler(views.notice_digest, commands=['digest'], state="*")
 
     dp.register_message_handler(
         views.manage_subscription,
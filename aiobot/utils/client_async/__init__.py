@@ -1,6 +1,13 @@
 from .adapter import AdapterAioHttp
 from .connection import ConnectionAioHttp
+from .session import http_session
+from .cache import ValidatorCache, NOT_MODIFIED
+from .single_flight import SingleFlight, normalize_url
+from .body import ResponseBody, MappedResponseBody, get_charset
 
 __all__ = (
-    'AdapterAioHttp', 'ConnectionAioHttp'
+    'AdapterAioHttp', 'ConnectionAioHttp', 'http_session',
+    'ValidatorCache', 'NOT_MODIFIED',
+    'SingleFlight', 'normalize_url',
+    'ResponseBody', 'MappedResponseBody', 'get_charset',
 )
@@ -1,32 +1,85 @@
 import asyncio
 import traceback
 
+from collections import deque
+from urllib.parse import urlparse
+
 from .connection import ConnectionAioHttp
-from .exceptions import HttpError, ConsumerError
+from .exceptions import HttpError, ConsumerError, HTTPResponseError, ConnectionTimeout
+from .throttle import HostThrottle
+from .aimd import AimdController
 
 
 class AdapterAioHttp(object):
     """
+    per_host - режим, в котором для каждого хоста своя очередь и свои потребители,
+        нагрузка на хост ограничивается HostThrottle (host_limit одновременных запросов
+        и host_delay секунд между запросами), разные хосты обрабатываются параллельно.
+        Для отдельного хоста параметры можно передать в элементе очереди по ключу throttle:
+        {'limit': 2, 'delay': 1, 'max_limit': 5}
+    adaptive - для режима per_host: limit хоста подбирается AimdController
+        в пределах от 1 до host_max_limit по задержке и доле ответов 429/5xx,
+        текущие окна доступны через get_hosts_stats()
+    params_iter в queue_request - список или асинхронный итератор параметров запросов,
+        во втором случае запросы начинаются с первого элемента, а ограниченная очередь
+        притормаживает чтение итератора (в режиме per_host заполненная очередь одного хоста
+        чтение не останавливает - элементы для него ждут в его overflow, чтение останавливается,
+        когда во всех overflow вместе overflow_size элементов, по умолчанию queue_size)
+    validator_cache - кэш ETag / Last-Modified (ValidatorCache) для элементов очереди
+        с conditional=True, если ресурс не изменился в handler_response передается NOT_MODIFIED
+    spool_threshold - ответы больше этого размера (байт) хранятся во временном файле (см. ConnectionAioHttp)
     """
     def __init__(self,
                  handler_response=None,
                  handler_errors=None,
                  queue_size=100,
-                 count_consumer=1):
+                 count_consumer=1,
+                 per_host=False,
+                 host_limit=1,
+                 host_delay=2,
+                 adaptive=False,
+                 host_max_limit=10,
+                 validator_cache=None,
+                 spool_threshold=None,
+                 overflow_size=None):
         self.queue_size = queue_size
+        self.overflow_size = overflow_size or queue_size
         self.count_consumer = count_consumer
         self.handler_response = handler_response
         self.handler_errors = handler_errors
-        self._connector = ConnectionAioHttp()
+        self.per_host = per_host
+        self.host_limit = host_limit
+        self.host_delay = host_delay
+        self.adaptive = adaptive
+        self.host_max_limit = host_max_limit
+        self._hosts = {}
+        self._connector = ConnectionAioHttp(validator_cache=validator_cache,
+                                            spool_threshold=spool_threshold)
 
     def get_connector(self):
         return self._connector
 
+    def get_hosts_stats(self):
+        """Текущее состояние хостов в режиме per_host (для мониторинга)"""
+        stats = {}
+        for host, host_data in self._hosts.items():
+            controller = host_data['controller']
+            if controller is not None:
+                stats[host] = controller.get_stats()
+            else:
+                throttle = host_data['throttle']
+                stats[host] = {'window': throttle.limit, 'active': throttle.active}
+            stats[host]['queue_depth'] = host_data['queue'].qsize() + len(host_data['overflow'])
+        return stats
+
     async def single_request(self, url, **kwargs):
         async with self._connector as connector:
             return await connector.perform_request(url, **kwargs)
 
     async def queue_request(self, params_iter):
+        if self.per_host:
+            return await self._queue_request_per_host(params_iter)
+
         queue = asyncio.Queue(maxsize=self.queue_size)
         async with self._connector as connector:
             # schedule the consumer - задачи теперь в цикле событий в ожидании
@@ -48,27 +101,133 @@ class AdapterAioHttp(object):
         if queue_complete and not queue_complete.done():
             await _cancel_task(queue_complete)
 
-        errors = []
-        for consumer_future in consumers:
-            await _cancel_task(consumer_future)
-            if consumer_future.cancelled():
-                continue
-            if consumer_future.exception() is not None:
-                errors.append(consumer_future.exception())
+        return await _collect_consumers_result(consumers)
 
-        if errors:
-            return {'errors': errors}
-        return {'result': 'success'}
+    async def _queue_request_per_host(self, params_iter):
+        """
+        Очереди и потребители создаются при появлении в params_iter нового хоста,
+        при падении любого потребителя (как и в обычном режиме) обработка прекращается
+        """
+        hosts = self._hosts = {}
+        consumer_failed = asyncio.get_running_loop().create_future()
+        async with self._connector as connector:
+            producer = asyncio.create_task(self.produce_per_host(
+                hosts=hosts, params_iter=params_iter,
+                connector=connector, consumer_failed=consumer_failed,
+                overflow_limit=asyncio.Semaphore(self.overflow_size)
+                ))
+            done, pending = await asyncio.wait([producer, consumer_failed],
+                                               return_when=asyncio.FIRST_COMPLETED)
+            queue_complete = None
+            if producer in done and not consumer_failed.done():
+                queue_complete = asyncio.create_task(_join_hosts(hosts))
+                await asyncio.wait([queue_complete, consumer_failed],
+                                   return_when=asyncio.FIRST_COMPLETED)
+            else:
+                await _cancel_task(producer)
+
+        if queue_complete and not queue_complete.done():
+            await _cancel_task(queue_complete)
+        if not consumer_failed.done():
+            consumer_failed.cancel()
+        for host_data in hosts.values():
+            if host_data['feeder'] is not None:
+                await _cancel_task(host_data['feeder'])
+
+        consumers = [task for host_data in hosts.values() for task in host_data['consumers']]
+        return await _collect_consumers_result(consumers)
 
     async def produce(self, queue, params_iter):
         """
         Производитель - кладет параметры запроса в очередь
         """
-        for item in params_iter:
+        async for item in _iterate(params_iter):
             await queue.put(item)
             await asyncio.sleep(2)
 
-    async def consumer(self, queue, connector):
+    async def produce_per_host(self, hosts, params_iter, connector, consumer_failed, overflow_limit):
+        """
+        Производитель для режима per_host - раскладывает параметры запроса по очередям хостов,
+        не дожидаясь места в очереди: если очередь хоста заполнена (хост медленный),
+        элемент ждет в overflow хоста, а в очередь его перекладывает отдельная задача,
+        поэтому медленный хост не задерживает запросы к остальным
+
+        overflow_limit - семафор на число элементов во всех overflow: когда он исчерпан,
+        производитель ждет (чтение params_iter притормаживается, как в обычном режиме)
+        """
+        async for item in _iterate(params_iter):
+            host = urlparse(item.get('url')).netloc
+            host_data = hosts.get(host)
+            if host_data is None:
+                host_data = self._start_host(item.get('throttle'), connector, consumer_failed)
+                hosts[host] = host_data
+            queue, overflow = host_data['queue'], host_data['overflow']
+            if not overflow and not queue.full():
+                queue.put_nowait(item)
+                continue
+            await overflow_limit.acquire()
+            overflow.append(item)
+            if host_data['feeder'] is None or host_data['feeder'].done():
+                host_data['feeder'] = asyncio.create_task(_feed_queue(queue, overflow, overflow_limit))
+
+    def _start_host(self, throttle_params, connector, consumer_failed):
+        limit = self.host_limit
+        delay = self.host_delay
+        max_limit = self.host_max_limit
+        if throttle_params:
+            if throttle_params.get('limit') is not None:
+                limit = throttle_params['limit']
+            if throttle_params.get('delay') is not None:
+                delay = throttle_params['delay']
+            if throttle_params.get('max_limit') is not None:
+                max_limit = throttle_params['max_limit']
+
+        def on_consumer_done(task):
+            if not task.cancelled() and not consumer_failed.done():
+                consumer_failed.set_result(None)
+
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        throttle = HostThrottle(limit=limit, delay=delay)
+        controller = None
+        count_consumer = limit
+        if self.adaptive:
+            # потребителей с запасом под максимальное окно, лишние ждут в throttle
+            count_consumer = max(limit, max_limit)
+            controller = AimdController(throttle, max_limit=count_consumer)
+        consumers = []
+        for _ in range(count_consumer):
+            task = asyncio.create_task(self.consumer(queue=queue,
+                                                     connector=connector,
+                                                     throttle=throttle,
+                                                     controller=controller))
+            task.add_done_callback(on_consumer_done)
+            consumers.append(task)
+        return {
+            'queue': queue, 'overflow': deque(), 'feeder': None,
+            'throttle': throttle, 'controller': controller, 'consumers': consumers
+            }
+
+    async def _perform_request(self, connector, throttle, controller, **kwargs):
+        if throttle is None:
+            return await connector.perform_request(**kwargs)
+
+        async with throttle:
+            if controller is None:
+                return await connector.perform_request(**kwargs)
+
+            async def on_attempt(elapsed, error):
+                # каждая попытка отдельно: повтор после 503 - это ошибка и успех,
+                # а не один долгий успешный запрос
+                if error is None:
+                    await controller.on_response(elapsed)
+                else:
+                    status_code = error.status_code if isinstance(error, HTTPResponseError) else None
+                    await controller.on_error(elapsed, status_code=status_code,
+                                              is_timeout=isinstance(error, ConnectionTimeout))
+
+            return await connector.perform_request(on_attempt=on_attempt, **kwargs)
+
+    async def consumer(self, queue, connector, throttle=None, controller=None):
         """
         Потребитель - забирает из очереди параметры запроса и совершает запрос
         """
@@ -81,9 +240,12 @@ class AdapterAioHttp(object):
                     auth = kwargs.get('auth')
                     headers = kwargs.get('headers')
                     cookies = kwargs.get('cookies')
+                    conditional = kwargs.get('conditional', False)
                     kwargs_handler = kwargs.get('kwargs')
-                    response = await connector.perform_request(url=url, params=params, auth=auth,
-                                                               headers=headers, cookies=cookies)
+                    response = await self._perform_request(connector, throttle, controller,
+                                                           url=url, params=params, auth=auth,
+                                                           headers=headers, cookies=cookies,
+                                                           conditional=conditional)
                     if self.handler_response is not None:
                         if kwargs_handler is None:
                             kwargs_handler = {'url': url}
@@ -122,6 +284,51 @@ class AdapterAioHttp(object):
                 raise ConsumerError(msg_exc)
 
 
+async def _iterate(params_iter):
+    """Общий обход для обычных и асинхронных итераторов"""
+    if hasattr(params_iter, '__aiter__'):
+        try:
+            async for item in params_iter:
+                yield item
+        finally:
+            # при отмене производителя сразу освобождаем ресурсы итератора (коннекцию к БД)
+            if hasattr(params_iter, 'aclose'):
+                await params_iter.aclose()
+    else:
+        for item in params_iter:
+            yield item
+
+
+async def _feed_queue(queue, overflow, overflow_limit):
+    """Перекладывание элементов из overflow хоста в его очередь по мере освобождения места"""
+    while overflow:
+        await queue.put(overflow[0])
+        overflow.popleft()
+        overflow_limit.release()
+
+
+async def _join_hosts(hosts):
+    """Ожидание обработки всех элементов хостов (сначала перекладываются overflow)"""
+    for host_data in hosts.values():
+        if host_data['feeder'] is not None:
+            await host_data['feeder']
+        await host_data['queue'].join()
+
+
+async def _collect_consumers_result(consumers):
+    errors = []
+    for consumer_future in consumers:
+        await _cancel_task(consumer_future)
+        if consumer_future.cancelled():
+            continue
+        if consumer_future.exception() is not None:
+            errors.append(consumer_future.exception())
+
+    if errors:
+        return {'errors': errors}
+    return {'result': 'success'}
+
+
 async def _cancel_task(task):
     if task.done():
         return
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+
+logger = logging.getLogger('service')
+
+# ответы, по которым считаем, что хост перегружен или нас ограничивает
+CONGESTION_STATUSES = (429, 500, 502, 503, 504)
+
+
+class AimdController:
+    """
+    Подбор окна (количество одновременных запросов к хосту) по принципу AIMD:
+        при нормальной задержке и без ошибок окно растет примерно на increase
+        за каждые window успешных ответов (т.е. за один "раунд" запросов),
+        при ответах 429/5xx, таймаутах или задержке больше latency_limit
+        окно умножается на decrease, но не чаще одного раза за среднюю задержку,
+        чтобы запросы одного окна не уменьшали его многократно
+
+    Текущее окно применяется как limit у HostThrottle
+    """
+    def __init__(self, throttle, min_limit=1, max_limit=10,
+                 latency_limit=5.0, increase=1, decrease=0.5, smoothing=0.2):
+        self.throttle = throttle
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_limit = latency_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.smoothing = smoothing
+        self.window = float(throttle.limit)
+        self.latency_avg = None
+        self.error_rate = 0.0
+        self.count_requests = 0
+        self.count_errors = 0
+        self._last_decrease = None
+
+    async def on_response(self, latency):
+        self._observe(latency, is_error=False)
+        if latency > self.latency_limit:
+            await self._decrease_window()
+        else:
+            await self._increase_window()
+
+    async def on_error(self, latency, status_code=None, is_timeout=False):
+        is_congestion = is_timeout or status_code in CONGESTION_STATUSES
+        self._observe(latency, is_error=is_congestion)
+        if is_congestion:
+            await self._decrease_window()
+
+    def get_stats(self):
+        return {
+            'window': int(self.window),
+            'active': self.throttle.active,
+            'latency_avg': self.latency_avg,
+            'error_rate': self.error_rate,
+            'requests': self.count_requests,
+            'errors': self.count_errors,
+            }
+
+    def _observe(self, latency, is_error):
+        self.count_requests += 1
+        if is_error:
+            self.count_errors += 1
+        if self.latency_avg is None:
+            self.latency_avg = latency
+        else:
+            self.latency_avg += self.smoothing * (latency - self.latency_avg)
+        self.error_rate += self.smoothing * (float(is_error) - self.error_rate)
+
+    async def _increase_window(self):
+        window = min(self.max_limit, self.window + self.increase / self.window)
+        await self._set_window(window)
+
+    async def _decrease_window(self):
+        now = asyncio.get_running_loop().time()
+        if (self._last_decrease is not None and self.latency_avg is not None and
+                now - self._last_decrease < self.latency_avg):
+            return
+        self._last_decrease = now
+        window = max(self.min_limit, self.window * self.decrease)
+        await self._set_window(window)
+
+    async def _set_window(self, window):
+        limit_old = int(self.window)
+        self.window = window
+        limit_new = int(window)
+        if limit_new != limit_old:
+            await self.throttle.set_limit(limit_new)
+            logger.debug(f"AIMD: окно изменено {limit_old} -> {limit_new}, "
+                         f"средняя задержка {self.latency_avg}, доля ошибок {self.error_rate}")
@@ -0,0 +1,73 @@
+import mmap
+
+
+class ResponseBody(bytearray):
+    """
+    Тело ответа - буфер, в который читался ответ (возвращается без копирования),
+    и кодировка из заголовка Content-Type (charset), если сервер ее указал, иначе None
+
+    результат одного запроса может достаться нескольким ожидающим (SingleFlight),
+    поэтому изменять тело нельзя
+    """
+    charset = None
+
+
+class MappedResponseBody:
+    """
+    Тело большого ответа во временном файле, отображенном в память (mmap) только для чтения
+
+    поддерживает то, что нужно парсерам без копирования: len, срезы, find / rfind,
+    buffer (memoryview для lxml), а decode и tobytes копируют все тело в память процесса
+    файл удаляется при close() или при удалении объекта
+    """
+    charset = None
+
+    def __init__(self, file):
+        self._file = file
+        self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @property
+    def buffer(self):
+        return memoryview(self._mmap)
+
+    def find(self, *args):
+        return self._mmap.find(*args)
+
+    def rfind(self, *args):
+        return self._mmap.rfind(*args)
+
+    def decode(self, encoding='utf-8', errors='strict'):
+        return self._mmap[:].decode(encoding, errors)
+
+    def tobytes(self):
+        return self._mmap[:]
+
+    def close(self):
+        mapped = getattr(self, '_mmap', None)
+        if mapped is not None and not mapped.closed:
+            mapped.close()
+        self._file.close()
+
+    def __len__(self):
+        return len(self._mmap)
+
+    def __getitem__(self, key):
+        return self._mmap[key]
+
+    def __del__(self):
+        self.close()
+
+    def __reduce__(self):
+        # в другой процесс (пул парсинга) передается копия тела
+        return (_restore_body, (self.tobytes(), self.charset))
+
+
+def _restore_body(data, charset):
+    body = ResponseBody(data)
+    body.charset = charset
+    return body
+
+
+def get_charset(body, default='utf-8'):
+    """Кодировка тела ответа, для обычных bytes - default"""
+    return getattr(body, 'charset', None) or default
@@ -0,0 +1,102 @@
+import os
+import json
+import tempfile
+
+from collections import OrderedDict
+
+
+class NotModified:
+    """
+    Результат запроса с валидаторами, когда сервер ответил 304 Not Modified,
+    т.е. содержимое не изменилось с прошлого запроса
+    """
+    def __repr__(self):
+        return 'NOT_MODIFIED'
+
+
+NOT_MODIFIED = NotModified()
+
+
+class ValidatorCache:
+    """
+    Кэш валидаторов HTTP (ETag / Last-Modified) по url
+    для условных запросов If-None-Match / If-Modified-Since
+
+    Размер ограничен max_size - вытесняются давно не использованные url (LRU),
+    если задан path - кэш загружается из файла и сохраняется в файл (json)
+    """
+    def __init__(self, max_size=10000, path=None):
+        self.max_size = max_size
+        self.path = path
+        self._data = OrderedDict()
+        self._loaded = False
+
+    def __len__(self):
+        return len(self._data)
+
+    def get_headers(self, url) -> dict:
+        validators = self._data.get(url)
+        if validators is None:
+            return {}
+        self._data.move_to_end(url)
+        headers = {}
+        if 'etag' in validators:
+            headers['If-None-Match'] = validators['etag']
+        if 'last_modified' in validators:
+            headers['If-Modified-Since'] = validators['last_modified']
+        return headers
+
+    def update(self, url, response_headers):
+        validators = {}
+        etag = response_headers.get('ETag')
+        if etag:
+            validators['etag'] = etag
+        last_modified = response_headers.get('Last-Modified')
+        if last_modified:
+            validators['last_modified'] = last_modified
+
+        if not validators:
+            self._data.pop(url, None)
+            return
+        self._data[url] = validators
+        self._data.move_to_end(url)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def discard(self, url):
+        """Удаляем валидаторы, если результат запроса не удалось обработать,
+        чтобы в следующий раз данные были получены полностью"""
+        self._data.pop(url, None)
+
+    def load(self):
+        """Загрузка из файла выполняется один раз"""
+        if self._loaded or not self.path:
+            return
+        self._loaded = True
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError:
+            # поврежденный файл - начинаем с пустого кэша
+            return
+        for url, validators in data:
+            self._data[url] = validators
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def save(self):
+        """Запись через временный файл, чтобы не оставить поврежденный файл"""
+        if not self.path:
+            return
+        dir_name = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(dir_name, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=dir_name, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(list(self._data.items()), f)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
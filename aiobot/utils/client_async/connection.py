@@ -1,20 +1,64 @@
 import asyncio
+import tempfile
+
 import aiohttp
 
+from collections.abc import Mapping
+from urllib.parse import urlencode
+
 from .exceptions import (
     HttpError, ConnectionRequestError, ConnectionTimeout,
     HTTPResponseError, HTTPResponseEntityTooLarge, ConnectionRetryError
     )
+from .session import http_session, TIMEOUT
+from .cache import NOT_MODIFIED
+from .body import ResponseBody, MappedResponseBody
+from .single_flight import SingleFlight, normalize_url
 
 
 from apps.shopwatcher.management import send_msg_admins
 
-# по умолчанию и в библиотеке 5 мин
-TIMEOUT = 5 * 60
 DEFAULT_CHUNK_SIZE = 64 * 2**10
 # 50 Mb = 50 * 2**10 * 2**10 = 50 * 1024 * 1024 = 52428800
 RESPONSE_MAX_BYTES = 30 * 2**10 * 2**10
 
+# общий для всех соединений, чтобы одновременные GET запросы одной ссылки
+# (парсинг по расписанию и ссылки от пользователей) выполнялись один раз
+request_flight = SingleFlight()
+
+
+# параметры запроса, которые не меняют ответ или уже учтены в ключе объединения
+_FLIGHT_KEY_KWARGS = frozenset(('params', 'conditional', 'timeout', 'headers', 'cookies', 'auth'))
+
+
+def _get_flight_key(url, kwargs):
+    """
+    Ключ объединения одновременных GET запросов: ссылка и все, от чего зависит ответ
+    (заголовки, cookies, auth), None - запрос не объединяется с другими
+    (есть параметры, которые нельзя сравнить)
+    """
+    if not _FLIGHT_KEY_KWARGS.issuperset(kwargs):
+        return None
+    key = [normalize_url(url, kwargs.get('params')), kwargs.get('conditional', False)]
+    for name in ('headers', 'cookies'):
+        value = kwargs.get(name)
+        if value is None:
+            key.append(None)
+        elif isinstance(value, Mapping):
+            key.append(tuple(sorted(
+                (str(item_key).lower() if name == 'headers' else str(item_key), str(item_value))
+                for item_key, item_value in value.items()
+                )))
+        else:
+            return None
+    auth = kwargs.get('auth')
+    try:
+        hash(auth)
+    except TypeError:
+        return None
+    key.append(auth)
+    return tuple(key)
+
 
 class ConnectionAioHttp:
     """
@@ -22,25 +66,62 @@ class ConnectionAioHttp:
     кое-что взято из elasticsearch.py класс Transport() и aioelasticsearch - connection.py
 
     Организовано повторение запроса в случае ошибки
+
+    Если создана общая сессия http_session, то используется она
+    (закрывается только при остановке приложения), иначе создается своя сессия
+
+    Если задан validator_cache, то запросы с conditional=True отправляются
+    с If-None-Match / If-Modified-Since и при ответе 304 возвращается NOT_MODIFIED
+
+    coalesce - одновременные GET запросы одной ссылки с одинаковыми заголовками, cookies и auth
+        ждут результат одного запроса
+
+    Тело ответа читается в буфер нужного размера (по Content-Length) и возвращается
+    без копирования (ResponseBody), ответ больше spool_threshold байт
+    дописывается во временный файл и возвращается как MappedResponseBody (mmap)
     """
 
-    def __init__(self, timeout=None, max_retries=3, retry_on_status=(502, 503, 504, )):
+    def __init__(self, timeout=None, max_retries=3, retry_on_status=(502, 503, 504, ), session=None,
+                 validator_cache=None, coalesce=True, spool_threshold=None):
         """
         retry_on_status
             502 Bad Gateway («плохой, ошибочный шлюз»)
             503 Service Unavailable («сервис недоступен»)
             504 Gateway Timeout («шлюз не отвечает»)
         """
-        if timeout is None:
-            timeout = aiohttp.ClientTimeout(total=TIMEOUT, connect=None, sock_read=None)
         self.max_retries = max_retries
         self.retry_on_status = retry_on_status
-        # сессия создастся с TCPConnector -> по умолчанию limit=100 - кол-во соединений
-        self.session = aiohttp.ClientSession(timeout=timeout)
+        self.validator_cache = validator_cache
+        self.coalesce = coalesce
+        self.spool_threshold = spool_threshold
+        # для общей сессии timeout передается в каждый запрос
+        self.timeout = timeout
+        if session is None and http_session.is_created:
+            session = http_session.session
+        if session is not None:
+            self.session = session
+            self._own_session = False
+        else:
+            if timeout is None:
+                timeout = aiohttp.ClientTimeout(total=TIMEOUT, connect=None, sock_read=None)
+            # сессия создастся с TCPConnector -> по умолчанию limit=100 - кол-во соединений
+            self.session = aiohttp.ClientSession(timeout=timeout)
+            self._own_session = True
 
-    async def perform_request(self, url, method='GET', **kwargs):
+    async def perform_request(self, url, method='GET', on_attempt=None, **kwargs):
         """
+        on_attempt(elapsed, error) - корутина, которая вызывается после каждой попытки
+        (в том числе повторной): время самого запроса без паузы перед повтором
+        и HttpError или None при успехе, для объединенного запроса - только у выполнявшего его
         """
+        if self.coalesce and method == 'GET':
+            key = _get_flight_key(url, kwargs)
+            if key is not None:
+                return await request_flight.do(key, self._perform_request, url, method, on_attempt, **kwargs)
+        return await self._perform_request(url, method, on_attempt, **kwargs)
+
+    async def _perform_request(self, url, method='GET', on_attempt=None, **kwargs):
+        loop = asyncio.get_running_loop()
         for attempt in range(self.max_retries + 1):
             if attempt > 0:
                 msg = f"Попытка номер {attempt} для {url}"
@@ -50,8 +131,11 @@ class ConnectionAioHttp:
                 # 0, 1, 3, 7, etc...
                 delay = 2**attempt - 1
                 await asyncio.sleep(delay)
+                time_start = loop.time()
                 resp_data = await self.request(url, method, **kwargs)
             except HttpError as e:
+                if on_attempt is not None:
+                    await on_attempt(loop.time() - time_start, e)
                 retry = False
                 if isinstance(e, (ConnectionRetryError, ConnectionTimeout)):
                     retry = True
@@ -63,21 +147,33 @@ class ConnectionAioHttp:
                 else:
                     raise e
             else:  # если исключения не было
+                if on_attempt is not None:
+                    await on_attempt(loop.time() - time_start, None)
                 return resp_data
 
-    async def request(self, url, method, **kwargs) -> bytes:
+    async def request(self, url, method, conditional=False, **kwargs) -> ResponseBody:
         """
-        возвращает словарь ответа (преобразованный из json)
+        возвращает тело ответа (ResponseBody или MappedResponseBody)
+        с кодировкой из заголовков в атрибуте charset
 
         на примере elesticsearch.py retry будем делать в случае ошибок
             ConnectionRequestError, ServerResponseError(502, 503, 504),
             ConnectionTimeout(хотя по умолчанию в elastic по ней нет повторного запроса)
         """
         raw_data = None
-        chunk_size = DEFAULT_CHUNK_SIZE
-        max_size = RESPONSE_MAX_BYTES
+        if self.timeout is not None and not self._own_session:
+            kwargs.setdefault('timeout', self.timeout)
+        use_cache = conditional and method == 'GET' and self.validator_cache is not None
+        if use_cache:
+            cache_key = _get_cache_key(url, kwargs.get('params'))
+            headers_validators = self.validator_cache.get_headers(cache_key)
+            if headers_validators:
+                kwargs['headers'] = {**(kwargs.get('headers') or {}), **headers_validators}
         try:
             async with self.session.request(method, url, **kwargs) as response:
+                if use_cache and response.status == 304:
+                    return NOT_MODIFIED
+
                 if 400 <= response.status < 500:
                     http_error_msg = '%s Client Error for url: %s' % (response.status, url)
                     raise HTTPResponseError(http_error_msg, status_code=response.status)
@@ -86,24 +182,10 @@ class ConnectionAioHttp:
                     http_error_msg = '%s Server Error for url: %s' % (response.status, url)
                     raise HTTPResponseError(http_error_msg, status_code=response.status)
 
-                # аналогия серверной части aiohttp - web_request.py - BaseRequest.read()
-                # сделал так чтобы ограничить размер скачанных данных
-                # в оригинальной read() этого нет, НО есть обработка ошибок см. - aiohttp\client_reqrep.py
-                # https://docs.aiohttp.org/en/stable/client_quickstart.html#streaming-response-content
-                body = bytearray()
-                size = 0
-                while True:
-                    chunk = await response.content.read(chunk_size)
-                    if not chunk:
-                        break
-                    body.extend(chunk)
-                    size += len(chunk)
-                    if 0 < max_size < size:
-                        msg = 'Maximum body size {} exceeded, actual size {}'\
-                            .format(max_size, size)
-                        raise HTTPResponseEntityTooLarge(msg)
-
-                raw_data = bytes(body)
+                raw_data = await self._read_body(response)
+                raw_data.charset = response.charset
+                if use_cache:
+                    self.validator_cache.update(cache_key, response.headers)
 
         except Exception as e:
             if isinstance(e, HttpError):  # наше базовое исключение
@@ -124,11 +206,80 @@ class ConnectionAioHttp:
             raise e
         return raw_data
 
+    async def _read_body(self, response):
+        """
+        аналогия серверной части aiohttp - web_request.py - BaseRequest.read()
+        сделал так чтобы ограничить размер скачанных данных
+        в оригинальной read() этого нет, НО есть обработка ошибок см. - aiohttp\client_reqrep.py
+        https://docs.aiohttp.org/en/stable/client_quickstart.html#streaming-response-content
+
+        при известном Content-Length буфер выделяется сразу (без перевыделений при росте),
+        при сжатии ответа Content-Length меньше тела - тогда буфер растет как обычно
+        """
+        chunk_size = DEFAULT_CHUNK_SIZE
+        max_size = RESPONSE_MAX_BYTES
+        spool_threshold = self.spool_threshold
+
+        content_length = response.content_length
+        if content_length and 0 < max_size < content_length:
+            msg = 'Maximum body size {} exceeded, actual size {}'.format(max_size, content_length)
+            raise HTTPResponseEntityTooLarge(msg)
+
+        if content_length and not (spool_threshold and content_length > spool_threshold):
+            body = ResponseBody(content_length)
+        else:
+            body = ResponseBody()
+        spool = None
+        size = 0
+        try:
+            while True:
+                chunk = await response.content.read(chunk_size)
+                if not chunk:
+                    break
+                size_new = size + len(chunk)
+                if 0 < max_size < size_new:
+                    msg = 'Maximum body size {} exceeded, actual size {}'\
+                        .format(max_size, size_new)
+                    raise HTTPResponseEntityTooLarge(msg)
+
+                if spool is not None:
+                    spool.write(chunk)
+                elif spool_threshold and size_new > spool_threshold:
+                    spool = tempfile.TemporaryFile()
+                    spool.write(memoryview(body)[:size])
+                    spool.write(chunk)
+                    body = None
+                elif size_new <= len(body):
+                    body[size:size_new] = chunk
+                else:
+                    del body[size:]
+                    body.extend(chunk)
+                size = size_new
+        except BaseException:
+            if spool is not None:
+                spool.close()
+            raise
+
+        if spool is not None:
+            spool.flush()
+            return MappedResponseBody(spool)
+        if size < len(body):
+            # сервер отдал меньше, чем указал в Content-Length
+            del body[size:]
+        return body
+
     async def close(self):
-        await self.session.close()
+        if self._own_session:
+            await self.session.close()
 
     async def __aenter__(self):
         return self
 
     async def __aexit__(self, *args):
         await self.close()
+
+
+def _get_cache_key(url, params=None):
+    if not params:
+        return url
+    return '%s?%s' % (url, urlencode(sorted(params.items())))
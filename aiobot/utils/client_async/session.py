@@ -0,0 +1,52 @@
+import aiohttp
+
+# по умолчанию и в библиотеке 5 мин
+TIMEOUT = 5 * 60
+
+
+class HttpSession:
+    """
+    Общая на все приложение aiohttp.ClientSession (по аналогии с db_engine)
+    создается в on_startup и закрывается в on_shutdown,
+    чтобы запросы переиспользовали keep-alive соединения и кэш DNS
+    """
+    def __init__(self):
+        self._session = None
+
+    @property
+    def session(self):
+        if self._session is None:
+            raise ValueError('Call create method before get session attr')
+        return self._session
+
+    @property
+    def is_created(self):
+        return self._session is not None and not self._session.closed
+
+    async def create(self, conn_params=None):
+        conn_params = conn_params or {}
+        connector = aiohttp.TCPConnector(
+            # всего соединений и соединений на один хост
+            limit=conn_params.get('limit', 100),
+            limit_per_host=conn_params.get('limit_per_host', 10),
+            # кэш DNS в секундах
+            ttl_dns_cache=conn_params.get('ttl_dns_cache', 300),
+            # сколько держать свободное соединение открытым
+            keepalive_timeout=conn_params.get('keepalive_timeout', 60),
+            )
+        timeout = aiohttp.ClientTimeout(
+            total=conn_params.get('timeout', TIMEOUT), connect=None, sock_read=None
+            )
+        # cookies передаются в каждый запрос явно (cookies магазинов из set_actual_cookies),
+        # Set-Cookie ответов не сохраняются, иначе результат зависел бы от порядка запросов
+        self._session = aiohttp.ClientSession(
+            connector=connector, timeout=timeout, cookie_jar=aiohttp.DummyCookieJar()
+            )
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+http_session = HttpSession()
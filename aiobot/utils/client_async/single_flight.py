@@ -0,0 +1,94 @@
+import asyncio
+
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+
+class _LeaderCancelled(Exception):
+    """Вызов отменен у выполнявшего его, ожидающие повторяют do"""
+
+
+class SingleFlight:
+    """
+    Объединение одновременных одинаковых вызовов:
+        пока выполняется вызов с ключом key, остальные вызовы с тем же ключом
+        ждут его результат (или исключение) вместо повторного выполнения,
+        если выполнявший вызов отменен, вызов заново выполняет один из ожидающих
+
+    ttl - сколько секунд после завершения отдавать готовый результат без нового вызова
+        (0 - не хранить), хранится не более max_size результатов
+    """
+    def __init__(self, ttl=0, max_size=1000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._in_flight = {}
+        self._recent = OrderedDict()
+
+    async def do(self, key, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        while True:
+            if self.ttl:
+                recent = self._recent.get(key)
+                if recent is not None:
+                    expires, result = recent
+                    if expires > loop.time():
+                        return result
+                    del self._recent[key]
+
+            future = self._in_flight.get(key)
+            if future is None:
+                return await self._call(loop, key, func, *args, **kwargs)
+            try:
+                # shield - отмена одного из ожидающих не должна отменять общий вызов
+                return await asyncio.shield(future)
+            except _LeaderCancelled:
+                # отменен тот, кто выполнял вызов, - вызов выполняет один из ожидающих
+                continue
+
+    async def _call(self, loop, key, func, *args, **kwargs):
+        future = loop.create_future()
+        future.add_done_callback(_retrieve_exception)
+        self._in_flight[key] = future
+        try:
+            result = await func(*args, **kwargs)
+        except asyncio.CancelledError:
+            future.set_exception(_LeaderCancelled())
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            self._remember(key, result, loop.time())
+        finally:
+            del self._in_flight[key]
+        return result
+
+    def _remember(self, key, result, now):
+        if not self.ttl:
+            return
+        self._recent[key] = (now + self.ttl, result)
+        self._recent.move_to_end(key)
+        while len(self._recent) > self.max_size:
+            self._recent.popitem(last=False)
+
+
+def _retrieve_exception(future):
+    """Чтобы не было предупреждения 'exception was never retrieved', если ожидающих нет"""
+    if not future.cancelled():
+        future.exception()
+
+
+def normalize_url(url, params=None):
+    """
+    Приведение url к одному виду для сравнения:
+    схема и хост в нижнем регистре, без фрагмента, параметры запроса отсортированы
+    """
+    parts = urlsplit(url.strip())
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    if params:
+        query.extend((str(key), str(value)) for key, value in params.items())
+    return urlunsplit((
+        parts.scheme.lower(), parts.netloc.lower(), parts.path or '/',
+        urlencode(sorted(query)), ''
+        ))
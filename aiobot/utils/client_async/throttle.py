@@ -0,0 +1,64 @@
+import asyncio
+
+
+class HostThrottle:
+    """
+    Ограничение нагрузки на один хост:
+        не более limit одновременных запросов
+        и не менее delay секунд между началом соседних запросов
+
+    limit можно менять на ходу - ожидающие запросы будут разбужены
+    """
+    def __init__(self, limit=1, delay=0):
+        self._limit = limit
+        self.delay = delay
+        self._active = 0
+        self._last_start = None
+        self._condition = asyncio.Condition()
+        self._spacing_lock = asyncio.Lock()
+
+    @property
+    def limit(self):
+        return self._limit
+
+    @property
+    def active(self):
+        return self._active
+
+    async def set_limit(self, limit):
+        async with self._condition:
+            self._limit = limit
+            self._condition.notify_all()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._active < self._limit)
+            self._active += 1
+        try:
+            await self._wait_spacing()
+        except BaseException:
+            await self.release()
+            raise
+
+    async def release(self):
+        async with self._condition:
+            self._active -= 1
+            self._condition.notify()
+
+    async def _wait_spacing(self):
+        if not self.delay:
+            return
+        async with self._spacing_lock:
+            loop = asyncio.get_running_loop()
+            if self._last_start is not None:
+                wait_seconds = self._last_start + self.delay - loop.time()
+                if wait_seconds > 0:
+                    await asyncio.sleep(wait_seconds)
+            self._last_start = loop.time()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.release()
@@ -0,0 +1,5 @@
+from .stage import Stage, Pipeline
+
+__all__ = (
+    'Stage', 'Pipeline'
+    )
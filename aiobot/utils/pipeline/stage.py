@@ -0,0 +1,129 @@
+import asyncio
+import logging
+
+logger = logging.getLogger('service')
+
+
+class Stage:
+    """
+    Стадия обработки: ограниченная очередь и свой пул обработчиков
+
+    handler(item) - корутина, если она возвращает не None и задана next_stage,
+        то результат передается в очередь следующей стадии
+        (при заполненной очереди следующей стадии обработчик ждет - так стадии
+        притормаживают друг друга)
+    исключения обработчика не останавливают стадию, а учитываются в счетчике errors
+
+    batch_size - если больше 1, то handler получает список до batch_size элементов:
+        все, что уже есть в очереди, а если их меньше, то после ожидания batch_wait секунд
+        еще и то, что успело прийти (для обработки пачкой, например записи в БД)
+    """
+    def __init__(self, name, handler, count_workers=1, queue_size=100, next_stage=None,
+                 batch_size=1, batch_wait=0.0):
+        self.name = name
+        self.handler = handler
+        self.count_workers = count_workers
+        self.next_stage = next_stage
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self._workers = []
+        self._time_start = None
+        self.count_processed = 0
+        self.count_errors = 0
+        self.busy_seconds = 0.0
+        self.max_queue_depth = 0
+
+    async def put(self, item):
+        await self.queue.put(item)
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+
+    def start(self):
+        self._time_start = asyncio.get_running_loop().time()
+        self._workers = [
+            asyncio.create_task(self._worker()) for _ in range(self.count_workers)
+            ]
+
+    async def join(self):
+        await self.queue.join()
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def get_stats(self):
+        elapsed = 0.0
+        if self._time_start is not None:
+            elapsed = asyncio.get_running_loop().time() - self._time_start
+        return {
+            'processed': self.count_processed,
+            'errors': self.count_errors,
+            'queue_depth': self.queue.qsize(),
+            'max_queue_depth': self.max_queue_depth,
+            'workers': self.count_workers,
+            # доля времени, когда обработчики были заняты - у узкого места близка к 1
+            'utilization': (self.busy_seconds / (elapsed * self.count_workers)) if elapsed else 0.0,
+            'per_second': (self.count_processed / elapsed) if elapsed else 0.0,
+            }
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = await self._get_items()
+            try:
+                time_start = loop.time()
+                try:
+                    result = await self.handler(items if self.batch_size > 1 else items[0])
+                finally:
+                    # ожидание места в очереди следующей стадии не считаем занятостью
+                    self.busy_seconds += loop.time() - time_start
+                self.count_processed += len(items)
+                if result is not None and self.next_stage is not None:
+                    await self.next_stage.put(result)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.count_errors += 1
+                logger.error(f"Ошибка в стадии {self.name}: {type(e)} {str(e)}")
+            finally:
+                for _ in items:
+                    self.queue.task_done()
+
+    async def _get_items(self):
+        items = [await self.queue.get()]
+        if self.batch_size > 1:
+            self._get_items_nowait(items)
+            if len(items) < self.batch_size and self.batch_wait:
+                await asyncio.sleep(self.batch_wait)
+                self._get_items_nowait(items)
+        return items
+
+    def _get_items_nowait(self, items):
+        while len(items) < self.batch_size and not self.queue.empty():
+            items.append(self.queue.get_nowait())
+
+
+class Pipeline:
+    """
+    Последовательность стадий, данные в первую стадию кладет внешний производитель,
+    join() ждет, пока все стадии по порядку обработают свои очереди
+    """
+    def __init__(self, stages):
+        self.stages = stages
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    async def join(self):
+        for stage in self.stages:
+            await stage.join()
+
+    async def stop(self):
+        for stage in self.stages:
+            await stage.stop()
+
+    def get_stats(self):
+        return {stage.name: stage.get_stats() for stage in self.stages}